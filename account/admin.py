@@ -1,6 +1,6 @@
 from simple_history.admin import SimpleHistoryAdmin
-from django.contrib.admin import register
-from .models import EmailDomain, UserToken, SignUpCode, Designation, UserProfile
+from django.contrib.admin import register, ModelAdmin
+from .models import EmailDomain, UserToken, SignUpCode, Designation, UserProfile, OutboxEmail
 
 
 @register(EmailDomain)
@@ -27,3 +27,9 @@ class DesignationAdmin(SimpleHistoryAdmin):
 class UserProfileAdmin(SimpleHistoryAdmin):
     list_display = ['id', 'user', 'college', 'picture']
 
+
+
+@register(OutboxEmail)
+class OutboxEmailAdmin(ModelAdmin):
+    list_display = ['to', 'subject', 'status', 'attempts', 'next_attempt', 'sent']
+    list_filter = ['status']
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from account.models import UserToken
+from account.tokencache import forget_tokens
+
+
+class Command(BaseCommand):
+    help = 'Expire tokens unused for UserToken.EXPIRY_DAYS and delete expired ones, in batches'
+
+    def add_arguments(self, parser):
+        # Batches are deleted by id, SQLite before 3.32 binds at most 999 parameters
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--purge-days', type=int, default=30,
+                            help='Delete expired tokens unused for this many days after expiring')
+
+    def in_batches(self, queryset, batch_size, apply):
+        total = 0
+        while True:
+            batch = list(queryset.values_list('id', 'token')[:batch_size])
+            if not batch:
+                return total
+            with transaction.atomic():
+                apply(UserToken.objects.filter(pk__in=[pk for pk, token in batch]))
+            forget_tokens([token for pk, token in batch])
+            total += len(batch)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        cutoff = now - timedelta(days=UserToken.EXPIRY_DAYS)
+
+        stale = UserToken.objects.filter(has_expired=False, last_accessed__lt=cutoff)
+        expired = self.in_batches(stale, batch_size, lambda batch: batch.update(has_expired=True))
+        self.stdout.write('Expired %d tokens' % expired)
+
+        purge_cutoff = cutoff - timedelta(days=options['purge_days'])
+        purgeable = UserToken.objects.filter(has_expired=True, last_accessed__lt=purge_cutoff)
+        purged = self.in_batches(purgeable, batch_size, lambda batch: batch.delete())
+        self.stdout.write('Deleted %d expired tokens' % purged)
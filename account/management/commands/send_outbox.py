@@ -0,0 +1,56 @@
+import time
+
+from django.core.mail import get_connection, EmailMessage
+from django.core.management.base import BaseCommand
+
+from account.models import OutboxEmail
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails of the outbox in claimed batches, one connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep draining the outbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait for new emails when looping')
+
+    def send_batch(self, emails):
+        sent = 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            for email in emails:
+                email.mark_failed('Connection failed: %r' % e)
+            return sent
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.message, email.from_email, [email.to],
+                                       connection=connection)
+                try:
+                    message.send()
+                except Exception as e:
+                    email.mark_failed(repr(e))
+                else:
+                    email.mark_sent()
+                    sent += 1
+        finally:
+            connection.close()
+        return sent
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = failed = 0
+        while True:
+            emails = OutboxEmail.claim(batch_size)
+            if emails:
+                sent = self.send_batch(emails)
+                total += sent
+                failed += len(emails) - sent
+            elif options['loop']:
+                time.sleep(options['interval'])
+            else:
+                break
+        self.stdout.write('Sent %d emails, %d failed attempts' % (total, failed))
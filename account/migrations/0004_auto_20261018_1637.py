@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 11:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_designation_historicaldesignation_historicaluserprofile_userprofile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usertoken',
+            name='last_accessed',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,13 +1,20 @@
 import uuid
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models
 from django.utils import timezone
 from django.utils.crypto import get_random_string
+from core.cache import bump_versions, user_version_key
 from core.models import File
 
 from simple_history.models import HistoricalRecords
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from .tokencache import update_cached_token, delete_cached_token, update_cached_user, delete_cached_user
+from .tokentouch import touch
 
 
 class EmailDomain(models.Model):
@@ -53,6 +60,30 @@ def create_profile(sender, instance, created, **kwargs):
 post_save.connect(create_profile, sender=User)
 
 
+def bump_user_version(sender, instance, **kwargs):
+    user_id = instance.user_id if isinstance(instance, UserProfile) else instance.pk
+    bump_versions([user_version_key(user_id)])
+
+
+def bump_designations_user_version(sender, instance, action, **kwargs):
+    # Designations are added from profiles, reverse changes are left to their own saves
+    if isinstance(instance, UserProfile) and action.startswith('post_'):
+        bump_user_version(sender, instance)
+
+
+def bump_designation_holders_versions(sender, instance, created, **kwargs):
+    if created:
+        return
+    user_ids = UserProfile.objects.filter(designations=instance).values_list('user_id', flat=True)
+    bump_versions([user_version_key(user_id) for user_id in user_ids])
+
+# Cached posts and replies embed their author, bump its version on changes of anything serialized with it
+post_save.connect(bump_user_version, sender=User)
+post_save.connect(bump_user_version, sender=UserProfile)
+m2m_changed.connect(bump_designations_user_version, sender=UserProfile.designations.through)
+post_save.connect(bump_designation_holders_versions, sender=Designation)
+
+
 def signup_code_generation():
     return get_random_string(length=8)
 
@@ -69,24 +100,136 @@ class SignUpCode(models.Model):
         return '%s: %s' % (self.email, self.code)
 
 
+class OutboxEmail(models.Model):
+    """
+    Email queued by views and sent by `send_outbox` command, so requests don't wait on SMTP. Failed sends are retried
+    with exponential backoff up to MAX_ATTEMPTS times.
+
+    Senders claim emails before sending them: status becomes sending and `next_attempt` the end of a lease of
+    LEASE_SECONDS. Emails of a sender that exits mid-batch are claimed again once their lease ends.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    MAX_ATTEMPTS = 5
+    # Seconds before first retry, doubled on every attempt
+    RETRY_DELAY = 60
+    LEASE_SECONDS = 5 * 60
+
+    subject = models.CharField(max_length=256)
+    message = models.TextField()
+    from_email = models.EmailField()
+    to = models.EmailField()
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = [('status', 'next_attempt')]
+
+    @classmethod
+    def due(cls, now=None):
+        return cls.objects.filter(status__in=[cls.STATUS_PENDING, cls.STATUS_SENDING],
+                                  next_attempt__lte=now or timezone.now()).order_by('next_attempt')
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Claim up to `limit` due emails with a conditional UPDATE, returns claimed emails. Emails claimed by a
+        concurrent sender after they were read aren't due any more and are left out.
+        """
+        now = timezone.now()
+        ids = list(cls.due(now).values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        lease = now + timedelta(seconds=cls.LEASE_SECONDS)
+        still_due = cls.objects.filter(pk__in=ids, status__in=[cls.STATUS_PENDING, cls.STATUS_SENDING],
+                                       next_attempt__lte=now)
+        still_due.update(status=cls.STATUS_SENDING, next_attempt=lease)
+        return list(cls.objects.filter(pk__in=ids, status=cls.STATUS_SENDING, next_attempt=lease).order_by('id'))
+
+    def mark_sent(self):
+        self.status = self.STATUS_SENT
+        self.attempts += 1
+        self.sent = timezone.now()
+        self.last_error = ''
+        self.save(update_fields=['status', 'attempts', 'sent', 'last_error'])
+
+    def mark_failed(self, error):
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.STATUS_FAILED
+        else:
+            self.status = self.STATUS_PENDING
+            self.next_attempt = timezone.now() + timedelta(seconds=self.RETRY_DELAY * 2 ** (self.attempts - 1))
+        self.save(update_fields=['status', 'attempts', 'next_attempt', 'last_error'])
+
+    def __str__(self):
+        return '%s: %s' % (self.to, self.subject)
+
+
 class UserToken(models.Model):
     user = models.ForeignKey(User)
     token = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True, unique=True)
     created = models.DateTimeField(auto_now_add=True)
-    last_accessed = models.DateTimeField(default=timezone.now)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
     has_expired = models.BooleanField(default=False)
 
+    # Tokens unused for longer expire
+    EXPIRY_DAYS = 30
+
+    @classmethod
+    def issue(cls, user):
+        """
+        Create token for user, deleting least recently used active tokens beyond MAX_TOKENS_PER_USER
+        """
+        user_token = cls.objects.create(user=user)
+        active = cls.objects.filter(user=user, has_expired=False).order_by('-last_accessed', '-id')
+        evicted = list(active.values_list('id', flat=True)[settings.MAX_TOKENS_PER_USER:])
+        if evicted:
+            cls.objects.filter(pk__in=evicted).delete()
+        return user_token
+
     def is_active(self):
+        """
+        Tell if token is active, expiring it if unused for EXPIRY_DAYS. `last_accessed` is recorded at most once per
+        TOKEN_TOUCH_INTERVAL seconds across processes and written in background by `tokentouch`.
+        """
         if self.has_expired:
             return False
         curr_date = timezone.now()
         diff = abs((curr_date - self.last_accessed).days)
-        # 1 month expiration date
-        if diff > 30:
+        if diff > self.EXPIRY_DAYS:
             self.has_expired = True
-            self.save()
+            self.save(update_fields=['has_expired'])
             return False
-        else:
-            self.last_accessed = curr_date
-            self.save()
-            return True
+        interval = settings.TOKEN_TOUCH_INTERVAL
+        if (curr_date - self.last_accessed).total_seconds() >= interval and \
+                cache.add('auth:token:touch:%s' % self.token.hex, True, interval):
+            touch(self, curr_date)
+        return True
+
+post_save.connect(update_cached_token, sender=UserToken)
+post_delete.connect(delete_cached_token, sender=UserToken)
+post_save.connect(update_cached_user, sender=User)
+post_delete.connect(delete_cached_user, sender=User)
+
+
+def resend_cached_user_save(sender, signal, **kwargs):
+    # Cached users are deferred proxies of User, Django sends their signals with the proxy as sender. Deletes aren't
+    # resent, receivers of any sender would keep Django from fast deleting rows of all models.
+    if sender._deferred and sender._meta.proxy_for_model is User:
+        signal.send(sender=User, **kwargs)
+
+post_save.connect(resend_cached_user_save)
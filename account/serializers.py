@@ -24,7 +24,8 @@ class LoginSerializer(serializers.Serializer):
 class FilteredVerifiedDesignation(serializers.ListSerializer):
 
     def to_representation(self, data):
-        data = data.filter(verified=True)
+        # Filter in python so that prefetched designations don't trigger a query per user
+        data = [designation for designation in data.all() if designation.verified]
         return super().to_representation(data)
 
 
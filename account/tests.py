@@ -1,3 +1,339 @@
-from django.test import TestCase
+import os
+from datetime import timedelta
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from college.models import College
+from core.cache import clear_local_caches
+from core.tests import LocMemCacheTestCase, QueryBudgetTestCase, PNG_BASE64, PNG_BYTES
+from .models import EmailDomain, SignUpCode, UserToken, OutboxEmail
+from .throttling import TokenBucketThrottle
+from .tokencache import get_token_user, user_key
+from . import tokentouch
+
+
+class AccountQueryBudgetTest(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        EmailDomain.objects.create(domain='example.com')
+        self.emails = iter('student%d@example.com' % index for index in range(100))
+
+    def test_register(self):
+        self.assertQueryBudget(5, lambda dataset: ('post', '/api/account/register/', {'email': next(self.emails)}))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.count(), len(self.dataset_sizes))
+
+    def test_resend(self):
+        self.assertQueryBudget(6, lambda dataset: ('post', '/api/account/resend/', {'email': next(self.emails)}))
+
+    def test_create_account(self):
+        def make_request(dataset):
+            signup_code = SignUpCode.objects.create(email=next(self.emails))
+            data = {
+                'email': signup_code.email,
+                'code': signup_code.code,
+                'username': signup_code.email.partition('@')[0],
+                'password': 'password',
+            }
+            return 'post', '/api/account/create_account/', data
+        self.assertQueryBudget(10, make_request)
+
+    def test_login(self):
+        data = {'username': 'tester', 'password': 'password'}
+        self.assertQueryBudget(1, lambda dataset: ('post', '/api/account/login/', data))
+
+
+class UserQueryBudgetTest(QueryBudgetTestCase):
+
+    def test_list(self):
+        self.assertQueryBudget(4, lambda dataset: ('get', '/api/user/', None))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(4, lambda dataset: ('get', '/api/user/%d/' % dataset['users'][0].id, None))
+
+    def test_update_profile(self):
+        def make_request(dataset):
+            data = {'first_name': 'First', 'college': dataset['colleges'][-1].id}
+            return 'post', '/api/user/%d/update_profile/' % self.user.id, data
+        self.assertQueryBudget(10, make_request)
+
+    def test_update_picture(self):
+        def make_request(dataset):
+            return 'post', '/api/user/%d/update_picture/' % self.user.id, {'file': PNG_BASE64}
+        self.assertQueryBudget(11, make_request)
+
+    def test_add_designation(self):
+        def make_request(dataset):
+            return 'post', '/api/user/%d/add_designation/' % self.user.id, {'name': 'Mentor'}
+        self.assertQueryBudget(10, make_request)
+
+    def test_get_designations(self):
+        self.assertQueryBudget(
+            2, lambda dataset: ('get', '/api/user/%d/get_designations/' % dataset['users'][0].id, None))
+
+    def test_current(self):
+        self.assertQueryBudget(5, lambda dataset: ('get', '/api/user/current/', None))
+
+    def test_update_picture_multipart(self):
+        url = '/api/user/%d/update_picture/' % self.user.id
+        response = self.client.post(url, {'file': SimpleUploadedFile('picture.png', PNG_BYTES)}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['picture']['mime_type'], 'image/png')
+
+    def test_current_not_modified(self):
+        etag = self.client.get('/api/user/current/')['ETag']
+        self.assertEqual(self.client.get('/api/user/current/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        data = {'first_name': 'First', 'college': College.objects.create(name='College', location='Location').id}
+        self.client.post('/api/user/%d/update_profile/' % self.user.id, data, format='json')
+        self.assertEqual(self.client.get('/api/user/current/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TokenAuthenticationTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.token = UserToken.objects.create(user=self.user)
+        self.client = APIClient(HTTP_TOKEN_AUTH=self.token.token.hex)
+
+    def get_auth_queries(self, url='/api/tag/'):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [query['sql'] for query in queries if 'usertoken' in query['sql'] or 'auth_user' in query['sql']]
+
+    def test_cached_token_runs_no_queries(self):
+        self.assertEqual(self.get_auth_queries(), [])
+        clear_local_caches()
+        self.assertEqual(self.get_auth_queries(), [])
+        cache.clear()
+        clear_local_caches()
+        self.assertEqual(len(self.get_auth_queries()), 2)
+        self.assertEqual(self.get_auth_queries(), [])
+
+    @override_settings(TOKEN_TOUCH_INTERVAL=60, DEFERRED_TOKEN_TOUCHES=True)
+    def test_last_accessed_written_behind_once_per_interval(self):
+        UserToken.objects.filter(pk=self.token.pk).update(last_accessed=timezone.now() - timedelta(minutes=5))
+        cache.clear()
+        clear_local_caches()
+        # Times are flushed below instead of by the background thread
+        with patch.object(tokentouch, '_worker', object()):
+            self.assertEqual(len(self.get_auth_queries()), 2)
+            self.assertEqual(self.get_auth_queries(), [])
+            self.assertEqual(tokentouch.flush(), 1)
+        self.assertLess(timezone.now() - UserToken.objects.get(pk=self.token.pk).last_accessed, timedelta(minutes=1))
+        self.assertEqual(tokentouch.flush(), 0)
+
+    def test_cached_user_has_no_password(self):
+        self.get_auth_queries()
+        values = cache.get(user_key(self.user.pk))
+        self.assertNotIn('password', values)
+        self.assertEqual(values['username'], 'tester')
+        # Saving a cached user leaves the password alone and updates the cache like saving any user
+        user = get_token_user(UserToken, self.token.token)[1]
+        user.first_name = 'Tester'
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('password'))
+        self.assertEqual(cache.get(user_key(self.user.pk))['first_name'], 'Tester')
+
+    def test_expired_and_deleted_tokens_rejected(self):
+        self.token.last_accessed = timezone.now() - timedelta(days=40)
+        self.token.save()
+        self.assertEqual(self.client.get('/api/tag/').status_code, 403)
+        self.assertTrue(UserToken.objects.get(pk=self.token.pk).has_expired)
+
+        token = UserToken.objects.create(user=self.user)
+        client = APIClient(HTTP_TOKEN_AUTH=token.token.hex)
+        self.assertEqual(client.get('/api/tag/').status_code, 200)
+        token.delete()
+        self.assertEqual(client.get('/api/tag/').status_code, 403)
+        self.assertEqual(APIClient(HTTP_TOKEN_AUTH='invalid').get('/api/tag/').status_code, 403)
+
+
+@override_settings(MAX_TOKENS_PER_USER=2)
+class TokenLifecycleTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.credentials = {'username': 'tester', 'password': 'password'}
+
+    def login(self, client=None):
+        response = (client or APIClient()).post('/api/account/login/', self.credentials, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def test_login_reuses_token_of_client(self):
+        token = self.login()
+        self.assertEqual(self.login(APIClient(HTTP_TOKEN_AUTH=token)), token)
+        self.assertEqual(UserToken.objects.filter(user=self.user).count(), 1)
+
+    def test_least_recently_used_tokens_evicted(self):
+        tokens = [self.login() for _ in range(2)]
+        UserToken.objects.filter(token=tokens[0]).update(last_accessed=timezone.now() + timedelta(minutes=1))
+        tokens += [self.login() for _ in range(2)]
+        self.assertEqual({token.hex for token in UserToken.objects.values_list('token', flat=True)},
+                         {tokens[0], tokens[3]})
+        for token in tokens[1:3]:
+            self.assertEqual(APIClient(HTTP_TOKEN_AUTH=token).get('/api/tag/').status_code, 403)
+
+    def test_expire_tokens_command(self):
+        now = timezone.now()
+        ages = [0, 40, 70, 80]
+        tokens = [UserToken.objects.create(user=self.user) for _ in ages]
+        for token, age in zip(tokens, ages):
+            UserToken.objects.filter(pk=token.pk).update(last_accessed=now - timedelta(days=age))
+        UserToken.objects.filter(pk=tokens[3].pk).update(has_expired=True)
+
+        call_command('expire_tokens', '--batch-size=1', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(UserToken.objects.order_by('id').values_list('id', 'has_expired')),
+                         [(tokens[0].pk, False), (tokens[1].pk, True)])
+        # Cached entries of changed tokens are removed too
+        for token, status in zip(tokens, [200, 403, 403, 403]):
+            self.assertEqual(APIClient(HTTP_TOKEN_AUTH=token.token.hex).get('/api/tag/').status_code, status)
+
+
+class FlakyEmailBackend(EmailBackend):
+    """
+    Fails to send to addresses starting with `fail`
+    """
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('fail'):
+                raise ConnectionError('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+class OutboxTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        EmailDomain.objects.create(domain='example.com')
+
+    def send_outbox(self, *args):
+        call_command('send_outbox', *args, stdout=open(os.devnull, 'w'))
+
+    def test_register_queues_email(self):
+        response = APIClient().post('/api/account/register/', {'email': 'student@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['student@example.com'])
+        self.assertIn(SignUpCode.objects.get(email='student@example.com').code, mail.outbox[0].body)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_SENT, 1))
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_BACKEND='account.tests.FlakyEmailBackend')
+    def test_failed_sends_retried_with_backoff(self):
+        for to in ['one@example.com', 'fail@example.com', 'two@example.com']:
+            OutboxEmail.objects.create(subject='Subject', message='Message', from_email='no-reply@example.com', to=to)
+        FlakyEmailBackend.opened = 0
+        self.send_outbox('--batch-size=10')
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['one@example.com', 'two@example.com'])
+
+        failed = OutboxEmail.objects.get(to='fail@example.com')
+        self.assertEqual((failed.status, failed.attempts), (OutboxEmail.STATUS_PENDING, 1))
+        self.assertIn('Mailbox unavailable', failed.last_error)
+        delays = []
+        for attempt in range(OutboxEmail.MAX_ATTEMPTS - 1):
+            delays.append(round((failed.next_attempt - timezone.now()).total_seconds() / OutboxEmail.RETRY_DELAY))
+            OutboxEmail.objects.filter(pk=failed.pk).update(next_attempt=timezone.now())
+            self.send_outbox()
+            failed.refresh_from_db()
+        self.assertEqual(delays, [1, 2, 4, 8])
+        self.assertEqual((failed.status, failed.attempts), (OutboxEmail.STATUS_FAILED, OutboxEmail.MAX_ATTEMPTS))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_claimed_emails_skipped_by_other_senders(self):
+        emails = [OutboxEmail.objects.create(subject='Subject', message='Message', from_email='no-reply@example.com',
+                                             to='student%d@example.com' % index) for index in range(3)]
+        claimed = OutboxEmail.claim(2)
+        self.assertEqual([email.pk for email in claimed], [email.pk for email in emails[:2]])
+        # Sender that read due emails before the first one claimed them gets only the rest
+        with patch.object(OutboxEmail, 'due', lambda now=None: OutboxEmail.objects.order_by('id')):
+            self.assertEqual([email.pk for email in OutboxEmail.claim(3)], [emails[2].pk])
+        self.assertEqual(OutboxEmail.claim(3), [])
+
+        # Emails of a sender that exited are claimed again once their lease ends
+        OutboxEmail.objects.filter(pk=emails[0].pk).update(next_attempt=timezone.now())
+        self.send_outbox()
+        self.assertEqual([message.to for message in mail.outbox], [['student0@example.com']])
+
+
+@patch.dict(TokenBucketThrottle.THROTTLE_RATES, {'auth_ip': '100/min', 'auth_email': '2/hour', 'auth_username': '2/min'})
+class ThrottleTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        EmailDomain.objects.create(domain='example.com')
+        User.objects.create_user(username='tester', password='password')
+
+    def login(self, username='tester', **extra):
+        data = {'username': username, 'password': 'wrong'}
+        return APIClient(**extra).post('/api/account/login/', data, format='json')
+
+    def test_login_rejected_before_authenticate(self):
+        for _ in range(2):
+            self.assertEqual(self.login().status_code, 400)
+        with patch('account.views.authenticate') as authenticate:
+            response = self.login(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        authenticate.assert_not_called()
+        self.assertEqual(self.login('other').status_code, 400)
+
+    @patch.dict(TokenBucketThrottle.THROTTLE_RATES, {'auth_ip': '2/min'})
+    def test_spoofed_forwarded_for_ignored(self):
+        statuses = [self.login('user%d' % index, HTTP_X_FORWARDED_FOR='10.1.0.%d, 192.0.2.1' % index).status_code
+                    for index in range(3)]
+        self.assertEqual(statuses, [400, 400, 429])
+        self.assertEqual(self.login('user3', HTTP_X_FORWARDED_FOR='10.1.0.1, 192.0.2.2').status_code, 400)
+
+    def test_non_object_bodies_rejected(self):
+        for data in [['tester'], 'tester', 1]:
+            response = APIClient().post('/api/account/login/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    @patch.dict(TokenBucketThrottle.THROTTLE_RATES, {'auth_ip': '2/min'})
+    def test_buckets_refill(self):
+        now = [1000.0]
+        with patch.object(TokenBucketThrottle, 'timer', staticmethod(lambda: now[0])):
+            self.assertEqual([self.login('user%d' % index).status_code for index in range(3)], [400, 400, 429])
+            now[0] += 15
+            response = self.login('user3')
+            self.assertEqual((response.status_code, response['Retry-After']), (429, '15'))
+            now[0] += 15
+            self.assertEqual(self.login('user4').status_code, 400)
+
+    def test_email_bucket_shared_across_ips_and_routes(self):
+        statuses = [APIClient(REMOTE_ADDR='10.0.0.%d' % index).post(
+            '/api/account/resend/', {'email': 'Student@example.com '}, format='json').status_code
+            for index in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = APIClient().post('/api/account/register/', {'email': 'student@example.com'}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+    def test_falls_back_to_local_cache(self):
+        shared = Mock(**{'get.side_effect': ConnectionError, 'set.side_effect': ConnectionError})
+        with patch.object(TokenBucketThrottle, 'cache', shared):
+            self.assertEqual([self.login().status_code for _ in range(3)], [400, 400, 429])
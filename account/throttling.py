@@ -0,0 +1,89 @@
+"""
+Token bucket throttles of signup and login routes, keyed by client IP, email and username of the request.
+
+A bucket holds up to `num_requests` tokens of its scope rate, refilled evenly over the rate period. Each request takes
+one, requests finding the bucket empty are rejected with Retry-After set to the time until a token is back. Buckets are
+kept in the shared cache and mirrored to an in-process cache, which takes over when the shared cache is unavailable.
+"""
+import hashlib
+import math
+
+from rest_framework.throttling import SimpleRateThrottle
+
+from core.cache import LocalCache
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+    local_cache = LocalCache(10000, 60 * 60 * 24)
+
+    def get_ident_value(self, request):
+        raise NotImplementedError('.get_ident_value() must be overridden')
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_value(request)
+        if not ident:
+            return None
+        # Idents come from request data, hash them to get a valid memcached key
+        return self.cache_format % {'scope': self.scope, 'ident': hashlib.md5(ident.encode()).hexdigest()}
+
+    def load_bucket(self):
+        try:
+            bucket = self.cache.get(self.key)
+        except Exception:
+            bucket = None
+        return bucket or self.local_cache.get(self.key)
+
+    def store_bucket(self, bucket):
+        self.local_cache.set(self.key, bucket)
+        try:
+            self.cache.set(self.key, bucket, self.duration)
+        except Exception:
+            pass
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        refill_rate = self.num_requests / self.duration
+        tokens, updated = self.load_bucket() or (self.num_requests, now)
+        tokens = min(self.num_requests, tokens + (now - updated) * refill_rate)
+        if tokens < 1:
+            self.wait_seconds = (1 - tokens) / refill_rate
+            return False
+        self.store_bucket((tokens - 1, now))
+        return True
+
+    def wait(self):
+        return math.ceil(self.wait_seconds)
+
+
+class IPThrottle(TokenBucketThrottle):
+    scope = 'auth_ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+
+def get_data_value(request, name):
+    # Bodies may be JSON lists or scalars, serializers reject them after throttling
+    data = request.data if isinstance(request.data, dict) else {}
+    return str(data.get(name, '')).strip().lower()
+
+
+class EmailThrottle(TokenBucketThrottle):
+    scope = 'auth_email'
+
+    def get_ident_value(self, request):
+        return get_data_value(request, 'email')
+
+
+class UsernameThrottle(TokenBucketThrottle):
+    scope = 'auth_username'
+
+    def get_ident_value(self, request):
+        return get_data_value(request, 'username')
@@ -1,9 +1,14 @@
 from rest_framework import authentication, exceptions
 from .models import UserToken
+from .tokencache import get_token_user
 import uuid
 
 
 class TokenAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticate by token in `Token-Auth` header or `token-auth` query parameter. Tokens and users are read through
+    `tokencache`, so requests with a cached token run no queries.
+    """
 
     def authenticate(self, request):
         token = request.META.get('HTTP_TOKEN_AUTH') or request.query_params.get('token-auth')
@@ -12,14 +17,9 @@ class TokenAuthentication(authentication.BaseAuthentication):
         else:
             try:
                 uuid_token = uuid.UUID(token)
-                user_token = UserToken.objects.all().filter(token=uuid_token)
-                if user_token.exists():
-                    user_token = user_token[0]
-                    if user_token.is_active():
-                        user = user_token.user
-                        return user, user_token
-                    else:
-                        pass
+                user_token, user = get_token_user(UserToken, uuid_token)
+                if user_token is not None and user_token.is_active():
+                    return user, user_token
             except ValueError:
                 pass
-            raise exceptions.AuthenticationFailed('Invalid token')
\ No newline at end of file
+            raise exceptions.AuthenticationFailed('Invalid token')
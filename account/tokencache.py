@@ -0,0 +1,113 @@
+"""
+Two tier cache of tokens and their users for token authentication: an in-process LRU in front of the shared cache, so
+authenticated requests resolve their user without queries.
+
+Entries hold field values and are written through on save of tokens and users, so instances are built fresh for each
+request. LRUs of other processes keep entries up to TOKEN_LOCAL_CACHE_TIMEOUT seconds, so an expired token or a
+changed user is seen there that much later.
+
+Users are cached without their password hash, instances are loaded with it deferred so saving one never overwrites
+it. Their save signals are sent again for User, so receivers of User see them.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.query_utils import deferred_class_factory
+
+from core.cache import LocalCache
+
+_local = LocalCache(settings.TOKEN_LOCAL_CACHE_SIZE, settings.TOKEN_LOCAL_CACHE_TIMEOUT)
+
+
+def token_key(token):
+    return 'auth:token:%s' % token.hex
+
+
+def user_key(user_id):
+    return 'auth:user:%d' % user_id
+
+
+# Fields of users authentication and serializers need
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'email', 'is_active', 'is_staff', 'is_superuser',
+               'last_login', 'date_joined')
+
+
+def dump(instance, names=None):
+    names = names or [field.attname for field in instance._meta.concrete_fields]
+    return {name: getattr(instance, name) for name in names}
+
+
+def load(model, values):
+    deferred = [field.attname for field in model._meta.concrete_fields if field.attname not in values]
+    if deferred:
+        model = deferred_class_factory(model, deferred)
+    names = list(values)
+    return model.from_db('default', names, [values[name] for name in names])
+
+
+def _get(key, fetch, names=None):
+    values = _local.get(key)
+    if values is None:
+        values = cache.get(key)
+        if values is None:
+            instance = fetch()
+            if instance is None:
+                return None
+            values = dump(instance, names)
+            cache.set(key, values, settings.TOKEN_CACHE_TIMEOUT)
+        _local.set(key, values)
+    return values
+
+
+def _set(key, instance, names=None):
+    values = dump(instance, names)
+    cache.set(key, values, settings.TOKEN_CACHE_TIMEOUT)
+    _local.set(key, values)
+
+
+def _delete(key):
+    cache.delete(key)
+    _local.delete(key)
+
+
+def get_token_user(token_model, token):
+    """
+    Get (user token, user) for UUID `token`, (None, None) for unknown tokens
+    """
+    token_values = _get(token_key(token), lambda: token_model.objects.filter(token=token).first())
+    if token_values is None:
+        return None, None
+    user_model = token_model._meta.get_field('user').related_model
+    user_values = _get(user_key(token_values['user_id']),
+                       lambda: user_model.objects.filter(pk=token_values['user_id']).only(*USER_FIELDS).first(),
+                       USER_FIELDS)
+    if user_values is None:
+        return None, None
+    user_token, user = load(token_model, token_values), load(user_model, user_values)
+    user_token.user = user
+    return user_token, user
+
+
+def forget_tokens(tokens):
+    """
+    Remove entries of `tokens`, for tokens changed by queryset updates which send no signals
+    """
+    keys = [token_key(token) for token in tokens]
+    cache.delete_many(keys)
+    for key in keys:
+        _local.delete(key)
+
+
+def update_cached_token(sender, instance, **kwargs):
+    _set(token_key(instance.token), instance)
+
+
+def delete_cached_token(sender, instance, **kwargs):
+    _delete(token_key(instance.token))
+
+
+def update_cached_user(sender, instance, **kwargs):
+    _set(user_key(instance.pk), instance, USER_FIELDS)
+
+
+def delete_cached_user(sender, instance, **kwargs):
+    _delete(user_key(instance.pk))
@@ -0,0 +1,76 @@
+"""
+Write-behind of `last_accessed` of tokens. Requests record when they used a token and a background thread writes
+recorded times in batches every TOKEN_TOUCH_FLUSH_DELAY seconds, so authenticated requests don't write.
+
+Times are held in memory, ones still pending when a worker exits are lost. A token then looks unused for at most
+TOKEN_TOUCH_INTERVAL longer than it was, far less than UserToken.EXPIRY_DAYS.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.db.models import Case, When, Value, DateTimeField
+
+from .tokencache import forget_tokens
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+_pending = {}
+_lock = threading.Lock()
+_worker = None
+
+
+def write_batch(batch):
+    """
+    Write access times of (token id, (token, time)) pairs with one UPDATE
+    """
+    from .models import UserToken
+    whens = [When(pk=pk, then=Value(accessed, output_field=DateTimeField())) for pk, (token, accessed) in batch]
+    UserToken.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+        last_accessed=Case(*whens, output_field=DateTimeField()))
+    # Queryset updates send no signals
+    forget_tokens([token for _, (token, accessed) in batch])
+
+
+def flush():
+    """
+    Write recorded access times, returns number of tokens written
+    """
+    global _pending
+    with _lock:
+        pending, _pending = list(_pending.items()), {}
+    for start in range(0, len(pending), BATCH_SIZE):
+        write_batch(pending[start:start + BATCH_SIZE])
+    return len(pending)
+
+
+def _run():
+    while True:
+        time.sleep(settings.TOKEN_TOUCH_FLUSH_DELAY)
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception('Failed to write access times of tokens')
+        finally:
+            connection.close()
+
+
+def touch(user_token, accessed):
+    """
+    Record that `user_token` was used at `accessed`, written in background or right away if DEFERRED_TOKEN_TOUCHES is
+    off
+    """
+    global _worker
+    if not settings.DEFERRED_TOKEN_TOUCHES:
+        user_token.last_accessed = accessed
+        user_token.save(update_fields=['last_accessed'])
+        return
+    with _lock:
+        _pending[user_token.pk] = (user_token.token, accessed)
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name='token-toucher', daemon=True)
+            _worker.start()
@@ -1,6 +1,5 @@
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.decorators import list_route, detail_route
@@ -8,9 +7,12 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
 
+from core.cache import get_versions, user_version_key, college_version_key
 from core.serializers import UserSerializer, FileSerializer
 from core.core import get_apk_url
-from .models import SignUpCode, UserToken, EmailDomain, UserProfile, Designation
+from core.views import ConditionalResponseMixin
+from .models import SignUpCode, UserToken, EmailDomain, UserProfile, Designation, OutboxEmail
+from .throttling import IPThrottle, EmailThrottle, UsernameThrottle
 from .serializers import (SignUpWriteSerializer, RegistrationSerializer, LoginSerializer,
                           UpdateProfileSerializer, FilteredDesignationSerializer, DesignationSerializer)
 
@@ -36,9 +38,9 @@ class AccountViewset(viewsets.GenericViewSet):
         Regards,
         Team MHRD Link
         """ % (code, absolute_apk_url)
-        send_mail(subject, message, 'no-reply@mhrdapp.com', [to_email])
+        OutboxEmail.objects.create(subject=subject, message=message, from_email='no-reply@mhrdapp.com', to=to_email)
 
-    @list_route(methods=['POST'])
+    @list_route(methods=['POST'], throttle_classes=[IPThrottle, EmailThrottle])
     def register(self, request):
         """
         Register email for account creation
@@ -70,7 +72,7 @@ class AccountViewset(viewsets.GenericViewSet):
         else:
             return Response(serialized_email.errors, status=HTTP_400_BAD_REQUEST)
 
-    @list_route(methods=['POST'])
+    @list_route(methods=['POST'], throttle_classes=[IPThrottle, EmailThrottle])
     def resend(self, request):
         """
         Resend verification code
@@ -96,7 +98,8 @@ class AccountViewset(viewsets.GenericViewSet):
         else:
             return Response(serialized_email.errors, status=HTTP_400_BAD_REQUEST)
 
-    @list_route(methods=['POST'], serializer_class=RegistrationSerializer)
+    @list_route(methods=['POST'], serializer_class=RegistrationSerializer,
+                throttle_classes=[IPThrottle, EmailThrottle, UsernameThrottle])
     def create_account(self, request):
         """
         Create account by verifying code
@@ -122,7 +125,7 @@ class AccountViewset(viewsets.GenericViewSet):
             user = User.objects.create(username=username, email=email)
             user.set_password(password)
             user.save()
-            usertoken = UserToken.objects.create(user=user)
+            usertoken = UserToken.issue(user)
             return Response(
                 {
                     'success': True,
@@ -132,7 +135,7 @@ class AccountViewset(viewsets.GenericViewSet):
         else:
             return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
 
-    @list_route(methods=['POST'], serializer_class=LoginSerializer)
+    @list_route(methods=['POST'], serializer_class=LoginSerializer, throttle_classes=[IPThrottle, UsernameThrottle])
     def login(self, request):
         """
         Login user with credentials
@@ -148,19 +151,22 @@ class AccountViewset(viewsets.GenericViewSet):
             user = authenticate(username=username, password=password)
             if not user:
                 return Response({'success': False, 'error': 'Invalid username/password'}, status=HTTP_400_BAD_REQUEST)
+            elif isinstance(request.auth, UserToken) and request.auth.user_id == user.id:
+                # Client logging in again with its valid token keeps it
+                usertoken = request.auth
             else:
-                usertoken = UserToken.objects.create(user=user)
-                return Response(
-                    {
-                        'success': True,
-                        'token': usertoken.token.hex
-                    }
-                )
+                usertoken = UserToken.issue(user)
+            return Response(
+                {
+                    'success': True,
+                    'token': usertoken.token.hex
+                }
+            )
         return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
 
 
-class UserViewset(viewsets.ReadOnlyModelViewSet):
-    queryset = User.objects.all()
+class UserViewset(ConditionalResponseMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = UserSerializer.setup_eager_loading(User.objects.all())
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
@@ -193,8 +199,8 @@ class UserViewset(viewsets.ReadOnlyModelViewSet):
         response_serializer: core.serializers.UserSerializer
         parameters:
           - name: file
-            type: base64 string
-            description: Base64 string of image
+            type: base64 string or file
+            description: Base64 string of image in JSON or image file part of multipart request
             required: true
         """
         profile = get_object_or_404(UserProfile, user_id=pk)
@@ -257,4 +263,5 @@ class UserViewset(viewsets.ReadOnlyModelViewSet):
         ---
         response_serializer: core.serializers.UserSerializer
         """
-        return Response(UserSerializer(request.user).data)
+        versions = get_versions([user_version_key(request.user.id), college_version_key()])
+        return self.get_conditional_response(self.get_etag(versions), lambda: UserSerializer(request.user).data)
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from core.cache import bump_versions, college_version_key
 from core.models import File, Tag
 from account.models import EmailDomain
 from simple_history.models import HistoricalRecords
@@ -18,3 +20,11 @@ class College(models.Model):
     def __str__(self):
         return self.name
 
+
+def bump_college_version(sender, **kwargs):
+    bump_versions([college_version_key()])
+
+post_save.connect(bump_college_version, sender=College)
+post_delete.connect(bump_college_version, sender=College)
+m2m_changed.connect(bump_college_version, sender=College.tags.through)
+m2m_changed.connect(bump_college_version, sender=College.email_domains.through)
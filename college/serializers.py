@@ -4,10 +4,15 @@ from .models import College
 
 
 class CollegeSerializer(serializers.ModelSerializer):
-    logo = FileSerializer()
-    cover = FileSerializer()
+    logo = FileSerializer(variant='thumb')
+    cover = FileSerializer(variant='medium')
     tags = TagSerializer(many=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        queryset = queryset.select_related(prefix + 'logo', prefix + 'cover')
+        return queryset.prefetch_related(prefix + 'tags', prefix + 'email_domains')
+
     class Meta:
         model = College
         exclude_fields = ['email_domains']
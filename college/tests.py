@@ -1,3 +1,30 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from core.models import Tag
+from core.tests import LocMemCacheTestCase, QueryBudgetTestCase
+from .models import College
+
+
+class CollegeQueryBudgetTest(QueryBudgetTestCase):
+
+    def test_list(self):
+        self.assertQueryBudget(3, lambda dataset: ('get', '/api/college/', None))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(3, lambda dataset: ('get', '/api/college/%d/' % dataset['colleges'][0].id, None))
+
+
+class CollegeConditionalResponseTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.college = College.objects.create(name='College', location='Location')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='tester', password='password'))
+
+    def test_etag_changes_with_colleges(self):
+        etag = self.client.get('/api/college/')['ETag']
+        self.assertEqual(self.client.get('/api/college/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.college.tags.add(Tag.objects.create(tag='tag'))
+        self.assertEqual(self.client.get('/api/college/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
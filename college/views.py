@@ -2,11 +2,25 @@ from rest_framework.viewsets import ReadOnlyModelViewSet
 from .models import College
 from .serializers import CollegeSerializer
 from rest_framework.permissions import IsAuthenticated
+from core.cache import get_versions, college_version_key
+from core.views import ConditionalResponseMixin
 
 
-class CollegeViewset(ReadOnlyModelViewSet):
+class CollegeViewset(ConditionalResponseMixin, ReadOnlyModelViewSet):
 
-    queryset = College.objects.all()
+    queryset = CollegeSerializer.setup_eager_loading(College.objects.all())
     serializer_class = CollegeSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_college_etag(self, *parts):
+        return self.get_etag(get_versions([college_version_key()]), *parts)
+
+    def list(self, request, *args, **kwargs):
+        parent = super()
+        return self.get_conditional_response(self.get_college_etag(),
+                                             lambda: parent.list(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        parent = super()
+        return self.get_conditional_response(self.get_college_etag(kwargs['pk']),
+                                             lambda: parent.retrieve(request, *args, **kwargs).data)
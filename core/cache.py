@@ -0,0 +1,112 @@
+"""
+Version keys for cache invalidation. Cached entries embed versions of everything they depend on in their keys, so
+bumping a version makes old entries unreachable without scanning or deleting them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def new_version():
+    # Time based so a version evicted from cache never comes back with a value used before
+    return int(time.time() * 1000000)
+
+
+def get_versions(keys):
+    """
+    Get dict of version key -> version, initializing missing keys.
+    """
+    keys = list(keys)
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = new_version()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+def _bump_versions(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+
+def bump_versions(keys):
+    """
+    Bump versions now and again once current transaction commits. A reader may see the first bump before the rows
+    are committed and cache stale data under it, the second bump makes such entries unreachable.
+    """
+    keys = list(keys)
+    _bump_versions(keys)
+    transaction.on_commit(lambda: _bump_versions(keys))
+
+
+def user_version_key(user_id):
+    return 'user:version:%d' % user_id
+
+
+def tag_version_key(tag_id):
+    return 'tag:version:%d' % tag_id
+
+
+def tag_index_version_key():
+    return 'tag:index:version'
+
+
+def college_version_key():
+    # Colleges are few and edited through admin only, so one version covers all of them
+    return 'college:version'
+
+
+class LocalCache:
+    """
+    In-process LRU of at most `size` entries, each kept up to `timeout` seconds. Used as a first tier in front of the
+    shared cache for lookups done on every request.
+    """
+    instances = []
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        LocalCache.instances.append(self)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def clear_local_caches():
+    for local_cache in LocalCache.instances:
+        local_cache.clear()
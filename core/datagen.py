@@ -0,0 +1,121 @@
+"""
+Synthetic data generator used by query budget tests and benchmarks.
+"""
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+
+from account.models import UserProfile, Designation
+from core.cache import bump_versions, tag_index_version_key
+from college.models import College
+from core.models import Tag
+from post.models import Post, Reply, Vote, FeedEntry, VOTE_UP, VOTE_DOWN
+from post.search import rebuild_index
+
+
+def _create_users(count, colleges, designations):
+    offset = User.objects.count()
+    User.objects.bulk_create([
+        User(username='user%d' % (offset + index), email='user%d@example.com' % (offset + index))
+        for index in range(count)
+    ])
+    users = list(User.objects.order_by('-id')[:count])
+    # bulk_create doesn't send post_save, so create profiles here
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, college=random.choice(colleges) if colleges else None) for user in users
+    ])
+    if designations:
+        through = UserProfile.designations.through
+        through.objects.bulk_create([
+            through(userprofile_id=profile_id, designation=random.choice(designations))
+            for profile_id in UserProfile.objects.filter(user__in=users).values_list('id', flat=True)
+        ])
+    return users
+
+
+def _create_votes(model, objects, users, count):
+    pairs = set()
+    for _ in range(count):
+        pairs.add((random.choice(objects).pk, random.choice(users).pk))
+
+    fk_name = model._meta.model_name + '_id'
+    votes = []
+    deltas = {}
+    for object_id, user_id in pairs:
+        value = random.choice([VOTE_UP, VOTE_DOWN])
+        votes.append(Vote(user_id=user_id, value=value, **{fk_name: object_id}))
+        delta = deltas.setdefault(object_id, [0, 0])
+        delta[value == VOTE_DOWN] += 1
+
+    Vote.objects.bulk_create(votes)
+    for object_id, (upvotes, downvotes) in deltas.items():
+        model.objects.filter(pk=object_id).update(
+            upvote_count=F('upvote_count') + upvotes,
+            downvote_count=F('downvote_count') + downvotes,
+        )
+
+
+def generate(colleges=1, users=10, tags=5, posts=20, replies=40, votes=60, seed=None):
+    """
+    Create given number of colleges, users, tags, posts, replies and votes with random relations.
+    Can be called multiple times to grow an existing dataset. Returns dict of created objects.
+    """
+    if seed is not None:
+        random.seed(seed)
+
+    with transaction.atomic():
+        tag_offset = Tag.objects.count()
+        Tag.objects.bulk_create([Tag(tag='tag%d' % (tag_offset + index)) for index in range(tags)])
+        tag_objects = list(Tag.objects.order_by('-id')[:tags]) or list(Tag.objects.all())
+
+        college_objects = []
+        for index in range(colleges):
+            college = College.objects.create(name='College %d' % index, location='Location %d' % index)
+            college.tags.add(*random.sample(tag_objects, min(len(tag_objects), 2)))
+            college_objects.append(college)
+        college_objects = college_objects or list(College.objects.all())
+
+        designations = list(Designation.objects.all()) or [
+            Designation.objects.create(name='Student', verified=True),
+            Designation.objects.create(name='Faculty', verified=False),
+        ]
+        user_objects = _create_users(users, college_objects, designations)
+
+        Post.objects.bulk_create([
+            Post(user=random.choice(user_objects), title='Post title', content='Post content %d' % index)
+            for index in range(posts)
+        ])
+        post_objects = list(Post.objects.order_by('-id')[:posts])
+        through = Post.tags.through
+        through.objects.bulk_create([
+            through(post=post, tag=tag) for post in post_objects for tag in random.sample(tag_objects, 1)
+        ])
+
+        Reply.objects.bulk_create([
+            Reply(user=random.choice(user_objects), post=random.choice(post_objects), content='Reply %d' % index)
+            for index in range(replies)
+        ] if post_objects else [])
+        reply_objects = list(Reply.objects.order_by('-id')[:replies])
+        Post.rebuild_reply_summaries([post.id for post in post_objects])
+
+        # bulk_create skips views and signals maintaining the feed and search indexes, so rebuild them
+        for college in College.objects.all():
+            FeedEntry.rebuild_college(college)
+        rebuild_index()
+        bump_versions([tag_index_version_key()])
+
+        if post_objects:
+            _create_votes(Post, post_objects, user_objects, votes)
+        if reply_objects:
+            _create_votes(Reply, reply_objects, user_objects, votes)
+        Post.update_hot([post.id for post in post_objects])
+
+    return {
+        'colleges': college_objects,
+        'tags': tag_objects,
+        'users': user_objects,
+        'posts': post_objects,
+        'replies': reply_objects,
+    }
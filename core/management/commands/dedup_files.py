@@ -0,0 +1,81 @@
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from account.models import UserProfile
+from college.models import College
+from core.cache import bump_versions, user_version_key, college_version_key
+from core.models import File
+from post.cache import bump_post_versions
+from post.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Compute missing digests of files and make files with same content share one stored blob'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report duplicates, do not change files')
+
+    def get_digest(self, name):
+        sha256 = hashlib.sha256()
+        with open(settings.MEDIA_ROOT + name, 'rb') as blob:
+            for chunk in iter(lambda: blob.read(64 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def bump_versions_using(self, file_ids):
+        """
+        Bump versions of cached data embedding URLs of files, queryset updates send no signals
+        """
+        for post in Post.objects.filter(attachments__in=file_ids).distinct().only('id'):
+            bump_post_versions(post)
+        user_ids = UserProfile.objects.filter(picture__in=file_ids).values_list('user_id', flat=True)
+        bump_versions([user_version_key(user_id) for user_id in user_ids])
+        if College.objects.filter(Q(logo__in=file_ids) | Q(cover__in=file_ids)).exists():
+            bump_versions([college_version_key()])
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        live = File.objects.exclude(file__startswith='deleted/')
+
+        digests = {}
+        for pk, name in live.filter(digest='').values_list('id', 'file'):
+            digests[pk] = self.get_digest(name)
+        if not dry_run:
+            with transaction.atomic():
+                for pk, digest in digests.items():
+                    File.objects.filter(pk=pk).update(digest=digest)
+        self.stdout.write('Computed %d digests' % len(digests))
+
+        groups = defaultdict(list)
+        for pk, name, digest in live.order_by('id').values_list('id', 'file', 'digest'):
+            groups[digests.get(pk, digest)].append((pk, name))
+
+        moved = set()
+        repointed = 0
+        for digest, files in groups.items():
+            canonical = files[0][1]
+            duplicates = [(pk, name) for pk, name in files if name != canonical]
+            if not duplicates:
+                continue
+            repointed += len(duplicates)
+            self.stdout.write('%s: %d files share %s' % (digest, len(files), canonical))
+            if dry_run:
+                continue
+            file_ids = [pk for pk, name in duplicates]
+            with transaction.atomic():
+                File.objects.filter(pk__in=file_ids).update(file=canonical)
+            # Cached data points to blobs about to move
+            self.bump_versions_using(file_ids)
+            for pk, name in duplicates:
+                if name not in moved:
+                    File.discard_blob(name)
+                    moved.add(name)
+
+        action = 'Found' if dry_run else 'Repointed'
+        self.stdout.write('%s %d duplicate files, moved %d blobs to deleted/' % (action, repointed, len(moved)))
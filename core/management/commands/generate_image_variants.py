@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.models import File
+from core.thumbnails import generate_variants
+
+
+class Command(BaseCommand):
+    help = ('Generate missing resized variants of stored images. Run it on a schedule, variants queued to worker '
+            'threads are lost when a worker exits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='Regenerate variants already generated')
+
+    def handle(self, *args, **options):
+        names = File.objects.filter(mime_type__startswith='image/').exclude(file__startswith='deleted/')
+        names = names.values_list('file', flat=True).distinct()
+        count = 0
+        for name in names.iterator():
+            generate_variants(name, force=options['force'])
+            count += 1
+        self.stdout.write('Checked variants of %d images' % count)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.datagen import generate
+
+
+class Command(BaseCommand):
+    help = 'Seed database with synthetic colleges, users, tags, posts, replies and votes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--colleges', type=int, default=5)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--replies', type=int, default=5000)
+        parser.add_argument('--votes', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        dataset = generate(
+            colleges=options['colleges'],
+            users=options['users'],
+            tags=options['tags'],
+            posts=options['posts'],
+            replies=options['replies'],
+            votes=options['votes'],
+            seed=options['seed'],
+        )
+        for name, objects in sorted(dataset.items()):
+            self.stdout.write('Created %d %s' % (len(objects), name))
@@ -0,0 +1,45 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import File
+from core.thumbnails import split_variant
+
+
+class Command(BaseCommand):
+    help = ('Move blobs in files/ no live file uses to deleted/. Run it on a schedule, moves queued to the background '
+            'thread are lost when a worker exits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Skip blobs modified in this many seconds, rows of new uploads may not be committed')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report blobs to move')
+
+    def get_orphans(self, names):
+        used = set(File.objects.filter(file__in=names).values_list('file', flat=True))
+        return [name for name in names if name not in used]
+
+    def handle(self, *args, **options):
+        directory = settings.MEDIA_ROOT + 'files/'
+        cutoff = time.time() - options['min_age']
+        names = []
+        for entry in os.scandir(directory) if os.path.isdir(directory) else []:
+            name = 'files/' + entry.name
+            # Variants go with their blob, temporary files of variants being written are skipped
+            if split_variant(name)[1] or name.endswith('.tmp') or entry.stat().st_mtime > cutoff:
+                continue
+            names.append(name)
+
+        moved = 0
+        for start in range(0, len(names), options['batch_size']):
+            for name in self.get_orphans(names[start:start + options['batch_size']]):
+                self.stdout.write(name)
+                if not options['dry_run']:
+                    File.discard_blob(name)
+                moved += 1
+        action = 'Found' if options['dry_run'] else 'Moved'
+        self.stdout.write('%s %d unused blobs' % (action, moved))
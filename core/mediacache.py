@@ -0,0 +1,44 @@
+"""
+Two tier cache of mime type by stored file name, used by media views to answer cache hits without a query: an
+in-process LRU in front of the shared cache.
+
+Entries are removed from both tiers of the deleting process when a blob moves to deleted/. LRUs of other processes
+keep entries up to MEDIA_MIME_LRU_TIMEOUT seconds, a stale one only redirects to a path the web server answers 404 for.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import LocalCache
+
+_lru = LocalCache(settings.MEDIA_MIME_LRU_SIZE, settings.MEDIA_MIME_LRU_TIMEOUT)
+
+
+def mime_type_key(name):
+    # Names come from request paths, hash them to get a valid memcached key
+    return 'file:mime:%s' % hashlib.md5(name.encode()).hexdigest()
+
+
+def get_mime_type(name):
+    """
+    Get mime type of stored file `name`, None if no file is stored under it
+    """
+    mime_type = _lru.get(name)
+    if mime_type is not None:
+        return mime_type
+    key = mime_type_key(name)
+    mime_type = cache.get(key)
+    if mime_type is None:
+        from .models import File
+        mime_type = File.objects.filter(file=name).values_list('mime_type', flat=True).first()
+        if mime_type is None:
+            return None
+        cache.set(key, mime_type, settings.RESPONSE_CACHE_TIMEOUT)
+    _lru.set(name, mime_type)
+    return mime_type
+
+
+def invalidate_mime_type(name):
+    _lru.delete(name)
+    cache.delete(mime_type_key(name))
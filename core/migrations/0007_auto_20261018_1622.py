@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_auto_20151217_1629'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='historicalfile',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:58
+from __future__ import unicode_literals
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_auto_20261018_1622'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(db_index=True, upload_to=core.models.file_upload),
+        ),
+        migrations.AlterField(
+            model_name='historicalfile',
+            name='file',
+            field=models.TextField(db_index=True, max_length=100),
+        ),
+    ]
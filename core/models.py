@@ -1,12 +1,22 @@
+import hashlib
 import os
 import uuid
 
 import magic
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_text
 from simple_history.models import HistoricalRecords
 
+from .cache import bump_versions, tag_index_version_key, college_version_key
+from .mediacache import invalidate_mime_type
+from .thumbnails import schedule_variants, remove_variants
+from .trash import discard_blobs
+
 
 def file_upload(instance, filename):
     filename = uuid.uuid1().hex + uuid.uuid4().hex
@@ -18,40 +28,116 @@ class FileManger(models.Manager):
     class FileQueryset(models.query.QuerySet):
 
         def delete(self):
-            for file in self:
-                file.delete()
+            """
+            Mark files deleted with one UPDATE, skipping history, and move blobs no live file uses any more to deleted/
+            in background.
+            """
+            # Rows stay locked until blobs in use are known, File.save locks the row it takes a blob from
+            with transaction.atomic(savepoint=False):
+                live = self.filter(file__startswith='files/')
+                names = set(live.select_for_update().values_list('file', flat=True))
+                if not names:
+                    return
+                live.update(file=Concat(Value('deleted/'), Substr('file', len('files/') + 1)))
+                used = set(File.objects.filter(file__in=names).values_list('file', flat=True))
+                for name in names:
+                    invalidate_mime_type(name)
+                discard_blobs(names - used)
 
     def get_queryset(self):
         return self.FileQueryset(self.model, using=self._db)
 
 
 class File(models.Model):
-    file = models.FileField(upload_to=file_upload)
+    """
+    Uploaded file. Rows with same content share one stored blob, found by SHA-256 `digest` of the content. A blob is
+    moved to deleted/ only when the last row using it is deleted.
+    """
+    file = models.FileField(upload_to=file_upload, db_index=True)
     mime_type = models.CharField(max_length=64)
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     _history_ = HistoricalRecords()
 
     @classmethod
     def get_mime_type(cls, value):
-        return magic.from_buffer(value.read(1024), mime=True)
+        # Older python-magic returns bytes
+        return force_text(magic.from_buffer(value.read(1024), mime=True))
 
-    def delete(self, using=None, keep_parents=False):
-        name = self.file.name
-        uuid_hex = name.split('/')[1]
-        new_name = 'deleted/%s' % uuid_hex
-        initial_path = self.file.path
-        new_path = settings.MEDIA_ROOT + new_name
+    @classmethod
+    def get_digest(cls, value):
+        """
+        Get SHA-256 of file, taken from `digest` set by upload handlers if present.
+        """
+        digest = getattr(getattr(value, 'file', value), 'digest', None)
+        if digest:
+            return digest
+        sha256 = hashlib.sha256()
+        for chunk in value.chunks():
+            sha256.update(chunk)
+        value.seek(0)
+        return sha256.hexdigest()
+
+    def is_shared(self):
+        """
+        Tell if other rows use the blob of this row
+        """
+        others = File.objects.filter(file=self.file.name).exclude(pk=self.pk)
+        if self.digest:
+            others = others.filter(digest=self.digest)
+        return others.exists()
+
+    @classmethod
+    def discard_blob(cls, name):
+        """
+        Move stored blob `name` to deleted/, returns its new name
+        """
+        new_name = 'deleted/%s' % name.split('/')[1]
         if not os.path.exists(settings.MEDIA_ROOT + 'deleted/'):
             os.mkdir(settings.MEDIA_ROOT + 'deleted/', mode=0o755)
-        os.rename(initial_path, new_path)
+        os.rename(settings.MEDIA_ROOT + name, settings.MEDIA_ROOT + new_name)
+        remove_variants(name)
+        invalidate_mime_type(name)
+        return new_name
+
+    def is_image(self):
+        return self.mime_type.startswith('image/')
+
+    def delete(self, using=None, keep_parents=False):
+        name = self.file.name
+        new_name = 'deleted/%s' % name.split('/')[1]
+        # Blob stays while other rows use it, rows deleted earlier point to where it's moved by the last one
+        if not self.is_shared():
+            self.discard_blob(name)
         self.file.name = new_name
         self.save()
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        if not self.mime_type:
-            self.mime_type = self.get_mime_type(self.file)
-        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        new_blob = self.pk is None and self.file and not self.file._committed
+        upload, reused = self.file, False
+        with transaction.atomic(using=using, savepoint=False):
+            if new_blob:
+                self.digest = self.digest or self.get_digest(self.file)
+                # Locked so a concurrent bulk delete of the row sees this one using its blob
+                existing = File.objects.select_for_update().filter(digest=self.digest).exclude(
+                    file__startswith='deleted/').first()
+                if existing:
+                    # Point to stored blob with same content instead of storing it again
+                    self.file = existing.file.name
+                    self.mime_type = existing.mime_type
+                    new_blob, reused = False, True
+            if not self.mime_type:
+                self.mime_type = self.get_mime_type(self.file)
+            super().save(force_insert=force_insert, force_update=force_update, using=using,
+                         update_fields=update_fields)
+        if reused and not os.path.exists(settings.MEDIA_ROOT + self.file.name):
+            # Databases without row locks, like SQLite, can still let a delete move the blob, store the upload then
+            self.file = upload
+            super().save(using=using, update_fields=['file'])
+            new_blob = True
+        if new_blob and self.is_image():
+            schedule_variants(self.file.name)
 
     def __str__(self):
         return self.file.name
@@ -67,4 +153,9 @@ class Tag(models.Model):
         return self.tag
 
 
+def bump_tag_index_version(sender, **kwargs):
+    # Names of tags are also nested in cached posts and colleges, whose data is keyed by college version
+    bump_versions([tag_index_version_key(), college_version_key()])
 
+post_save.connect(bump_tag_index_version, sender=Tag)
+post_delete.connect(bump_tag_index_version, sender=Tag)
@@ -1,6 +1,23 @@
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework.pagination import CursorPagination
 
 
 class DefaultPaginationClass(CursorPagination):
+    """
+    Orders by `ordering` unless `order` query parameter names one of `cursor_orderings` of the view whose field the
+    paginated model has, so routes paginating other models ignore it.
+    """
 
     page_size = 20
+
+    def get_ordering(self, request, queryset, view):
+        orderings = getattr(view, 'cursor_orderings', {})
+        order = request.query_params.get('order')
+        if order in orderings:
+            try:
+                queryset.model._meta.get_field(orderings[order].lstrip('-'))
+            except FieldDoesNotExist:
+                pass
+            else:
+                return (orderings[order],)
+        return super().get_ordering(request, queryset, view)
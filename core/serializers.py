@@ -1,38 +1,111 @@
 from rest_framework import serializers
 from .models import File, Tag
+from .thumbnails import variant_name
 from django.contrib.auth.models import User
 from account.serializers import FilteredDesignationSerializer
 import django.utils.six
 import base64
 import binascii
+import hashlib
+import re
+import tempfile
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.translation import gettext_lazy as _
 
 
 class Base64FileField(serializers.FileField):
+    """
+    File uploaded as base64 string or as a multipart file part. The string is decoded in chunks into a temporary file,
+    which stays in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE bytes, so decoded data is never held in memory as a whole.
+    """
+    # Characters of base64 decoded at once, a multiple of 4
+    chunk_size = 64 * 1024
+    base64_characters = re.compile('[^A-Za-z0-9+/=]')
+    whitespace = ' \t\r\n'
+
+    def decode(self, data):
+        file = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        sha256 = hashlib.sha256()
+        size = 0
+        pending = ''
+        for start in range(0, len(data), self.chunk_size):
+            # Characters other than base64 alphabet are skipped like b64decode does, so decode whole quads only
+            chunk = pending + self.base64_characters.sub('', data[start:start + self.chunk_size])
+            end = len(chunk) - len(chunk) % 4
+            decoded = base64.b64decode(chunk[:end])
+            pending = chunk[end:]
+            size += len(decoded)
+            if size > settings.MAX_UPLOAD_SIZE:
+                raise ValidationError(_('File is too large'))
+            file.write(decoded)
+            sha256.update(decoded)
+        if pending:
+            raise binascii.Error('Incorrect padding')
+        file.seek(0)
+        uploaded_file = UploadedFile(file, 'uploadedfile.temp', size=size)
+        uploaded_file.digest = sha256.hexdigest()
+        return uploaded_file
 
     def to_internal_value(self, data):
         if not data:
             return None
 
+        if isinstance(data, UploadedFile):
+            # Already streamed to memory or disk by upload handlers
+            if data.size > settings.MAX_UPLOAD_SIZE:
+                raise ValidationError(_('File is too large'))
+            return super().to_internal_value(data)
+
         if isinstance(data, django.utils.six.string_types):
+            # Decoded data is 3/4 of base64 without line breaks, so reject too large files before decoding anything
+            length = len(data) - sum(data.count(character) for character in self.whitespace)
+            if length // 4 * 3 > settings.MAX_UPLOAD_SIZE + 2:
+                raise ValidationError(_('File is too large'))
             try:
-                decoded_data = base64.b64decode(data)
+                file_data = self.decode(data)
             except (TypeError, binascii.Error):
                 raise ValidationError(_("Please upload a valid file"))
 
-            file_data = ContentFile(decoded_data, 'uploadedfile.temp')
             return super().to_internal_value(file_data)
         raise ValidationError(_('Not a valid base64 string'))
 
 
 class FileSerializer(serializers.ModelSerializer):
+    """
+    With `variant`, `file` of images is URL of that resized variant. URLs of all variants and of the original are in
+    `variants`.
+    """
     file = Base64FileField()
+    variants = serializers.SerializerMethodField()
+
+    def __init__(self, *args, **kwargs):
+        self.variant = kwargs.pop('variant', None)
+        super().__init__(*args, **kwargs)
+
+    def get_url(self, file, name):
+        url = file.storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_variants(self, obj):
+        if not obj.is_image():
+            return {}
+        variants = {variant: self.get_url(obj.file, variant_name(obj.file.name, variant))
+                    for variant in settings.IMAGE_VARIANTS}
+        variants['original'] = self.get_url(obj.file, obj.file.name)
+        return variants
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.variant and data['variants']:
+            data['file'] = data['variants'][self.variant]
+        return data
 
     class Meta:
         model = File
-        fields = ['file', 'mime_type']
+        fields = ['file', 'mime_type', 'variants']
         read_only_fields = ['mime_type']
 
 
@@ -44,10 +117,17 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class UserSerializer(serializers.ModelSerializer):
-    picture = FileSerializer(source='profile.picture')
+    picture = FileSerializer(source='profile.picture', variant='thumb')
     college = serializers.SerializerMethodField()
     designations = FilteredDesignationSerializer(many=True, source='profile.designations')
 
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        from college.serializers import CollegeSerializer
+        queryset = queryset.select_related(prefix + 'profile__picture')
+        queryset = queryset.prefetch_related(prefix + 'profile__designations')
+        return CollegeSerializer.setup_eager_loading(queryset, prefix + 'profile__college__')
+
     def get_college(self, obj):
         from college.serializers import CollegeSerializer
         return CollegeSerializer(obj.profile.college).data
@@ -0,0 +1,70 @@
+"""
+Per-process index of tag names for autocomplete. Tags are kept in an array sorted by lowercase name, so that tags
+starting with a prefix are found by bisection, and ranked by number of posts using them. The index is rebuilt when
+version of tags in cache changes, which saving or deleting a tag bumps, and at least every `MAX_AGE` seconds so that
+usage counts don't go stale.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from django.db.models import Count
+
+from .cache import get_versions, tag_index_version_key
+from .models import Tag
+
+MAX_AGE = 5 * 60
+
+
+class TagIndex(object):
+
+    def __init__(self, tags):
+        """
+        `tags` is iterable of (id, name, usage)
+        """
+        self.tags = sorted((name.lower(), -usage, pk, name) for pk, name, usage in tags)
+        self.keys = [tag[0] for tag in self.tags]
+
+    @staticmethod
+    def rank(tag):
+        return tag[1], tag[0]
+
+    def search(self, query, limit):
+        """
+        Get up to `limit` tags as (id, name) whose name starts with `query`, most used first. If there are not enough
+        of them, tags containing `query` elsewhere in the name follow.
+        """
+        query = query.lower()
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + '\U0010ffff', start)
+        matches = heapq.nsmallest(limit, self.tags[start:end], key=self.rank)
+        if len(matches) < limit and query:
+            contains = (tag for tag in self.tags if query in tag[0] and not tag[0].startswith(query))
+            matches += heapq.nsmallest(limit - len(matches), contains, key=self.rank)
+        return [(pk, name) for _, _, pk, name in matches]
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_built = 0
+
+
+def build_index():
+    return TagIndex(Tag.objects.annotate(usage=Count('post')).values_list('id', 'tag', 'usage'))
+
+
+def get_index():
+    global _index, _index_version, _index_built
+    key = tag_index_version_key()
+    version = get_versions([key])[key]
+    if _index is None or version != _index_version or time.time() - _index_built > MAX_AGE:
+        with _lock:
+            if _index is None or version != _index_version or time.time() - _index_built > MAX_AGE:
+                _index, _index_version, _index_built = build_index(), version, time.time()
+    return _index
+
+
+def search_tags(query, limit=10):
+    return get_index().search(query, limit)
@@ -1,3 +1,406 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from account.models import UserToken
+from post.cache import post_version_key
+from post.models import Post, Reply
+from .datagen import generate
+from . import trash
+from .cache import clear_local_caches, get_versions, bump_versions, user_version_key
+from .models import File, Tag
+from .serializers import Base64FileField, FileSerializer
+from .tagindex import TagIndex, search_tags
+
+# Smallest valid PNG, used for upload tests
+PNG_BASE64 = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+PNG_BYTES = base64.b64decode(PNG_BASE64)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LocMemCacheTestCase(TestCase):
+    """
+    Runs tests against an empty in-process cache instead of memcached, with empty local caches.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        clear_local_caches()
+
+
+class TemporaryMediaTestCase(LocMemCacheTestCase):
+    """
+    Stores uploaded files in a temporary MEDIA_ROOT removed after tests.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root + '/')
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
+class QueryBudgetTestCase(TemporaryMediaTestCase):
+    """
+    Base class for tests asserting that an endpoint runs a bounded number of queries irrespective of page size and
+    dataset size. Every check grows the dataset through `dataset_sizes` and requires same query count at each size.
+    """
+    dataset_sizes = [
+        dict(colleges=1, users=5, tags=3, posts=5, replies=10, votes=15),
+        dict(colleges=2, users=30, tags=10, posts=60, replies=150, votes=300),
+    ]
+    # Datasets are generated from this seed, so query counts are the same on every run
+    seed = 0
+    # Seconds a request may take, timings vary too much between machines to be checked unless set
+    max_wall_time = None
+
+    def setUp(self):
+        super().setUp()
+        random.seed(self.seed)
+        self.user = User.objects.create_user(username='tester', email='tester@example.com', password='password')
+        self.token = UserToken.objects.create(user=self.user)
+        self.client = APIClient(HTTP_TOKEN_AUTH=self.token.token.hex)
+
+    def grow_dataset(self, size):
+        dataset = generate(**size)
+        self.user.profile.college = dataset['colleges'][0]
+        self.user.profile.save()
+        dataset['own_posts'] = dataset['posts'][:3]
+        Post.objects.filter(id__in=[post.id for post in dataset['own_posts']]).update(user=self.user)
+        dataset['own_replies'] = dataset['replies'][:3]
+        Reply.objects.filter(id__in=[reply.id for reply in dataset['own_replies']]).update(user=self.user)
+        return dataset
+
+    def measure(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            if method == 'get':
+                response = self.client.get(url, data)
+            else:
+                response = getattr(self.client, method)(url, data, format='json')
+            elapsed = time.time() - start
+        return response, len(queries), elapsed
+
+    def assertQueryBudget(self, max_queries, make_request, status=200):
+        """
+        `make_request` gets the dataset of current size and returns (method, url, data)
+        """
+        counts = []
+        for size in self.dataset_sizes:
+            dataset = self.grow_dataset(size)
+            method, url, data = make_request(dataset)
+            response, count, elapsed = self.measure(method, url, data)
+            self.assertEqual(response.status_code, status, '%s %s: %s' % (method.upper(), url, response.data))
+            self.assertLessEqual(count, max_queries, '%s %s ran %d queries' % (method.upper(), url, count))
+            if self.max_wall_time is not None:
+                self.assertLessEqual(elapsed, self.max_wall_time, '%s %s took %.3fs' % (method.upper(), url, elapsed))
+            counts.append(count)
+        self.assertEqual(len(set(counts)), 1, 'Query count grows with data size: %s' % counts)
+
+
+class TagQueryBudgetTest(QueryBudgetTestCase):
+
+    def test_list(self):
+        self.assertQueryBudget(1, lambda dataset: ('get', '/api/tag/', None))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(1, lambda dataset: ('get', '/api/tag/%d/' % dataset['tags'][0].id, None))
+
+    def test_search(self):
+        self.assertQueryBudget(1, lambda dataset: ('get', '/api/tag/search/', {'query': 'tag'}))
+
+
+class TagIndexTest(LocMemCacheTestCase):
+
+    def test_prefix_matches_rank_by_usage_before_substring_matches(self):
+        index = TagIndex([(1, 'Music', 1), (2, 'Musicals', 5), (3, 'Classical music', 9), (4, 'Sports', 0)])
+        self.assertEqual(index.search('mus', 10), [(2, 'Musicals'), (1, 'Music'), (3, 'Classical music')])
+        self.assertEqual(index.search('MUS', 1), [(2, 'Musicals')])
+        self.assertEqual(index.search('', 2), [(3, 'Classical music'), (2, 'Musicals')])
+        self.assertEqual(index.search('xyz', 10), [])
+
+    def test_search_follows_tag_changes(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='tester', password='password'))
+        tag = Tag.objects.create(tag='hostel')
+        self.assertEqual(client.get('/api/tag/search/', {'query': 'hos'}).data, [{'id': tag.id, 'tag': 'hostel'}])
+        with self.assertNumQueries(0):
+            search_tags('hos')
+        tag.tag = 'library'
+        tag.save()
+        self.assertEqual(client.get('/api/tag/search/', {'query': 'hos'}).data, [])
+
+
+class VersionTest(LocMemCacheTestCase):
+
+    def test_versions_bumped_again_on_commit(self):
+        key = 'test:version'
+        versions = [get_versions([key])[key]]
+        callbacks = []
+        with patch('core.cache.transaction.on_commit', callbacks.append):
+            bump_versions([key])
+        versions.append(get_versions([key])[key])
+        for callback in callbacks:
+            callback()
+        versions.append(get_versions([key])[key])
+        self.assertEqual(sorted(set(versions)), versions)
+
+
+class Base64FileFieldTest(TestCase):
+
+    def setUp(self):
+        self.field = Base64FileField()
+        self.field.chunk_size = 8
+
+    def test_decodes_in_chunks(self):
+        content = bytes(range(256)) * 4
+        encoded = base64.encodebytes(content).decode()
+        uploaded = self.field.to_internal_value(encoded)
+        self.assertEqual(uploaded.size, len(content))
+        self.assertEqual(uploaded.digest, hashlib.sha256(content).hexdigest())
+        self.assertEqual(uploaded.read(), content)
+        self.assertEqual(self.field.to_internal_value(PNG_BASE64).read(), PNG_BYTES)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_large_files_spool_to_disk(self):
+        uploaded = self.field.to_internal_value(base64.b64encode(b'x' * 1000).decode())
+        self.assertTrue(uploaded.file._rolled)
+
+    def test_invalid_data(self):
+        for data in ['abc', PNG_BASE64[:-3], 42]:
+            with self.assertRaises(ValidationError):
+                self.field.to_internal_value(data)
+
+    @override_settings(MAX_UPLOAD_SIZE=100)
+    def test_size_limit(self):
+        self.field.to_internal_value(base64.b64encode(b'x' * 100).decode())
+        # Line breaks don't count towards the size
+        wrapped = base64.encodebytes(b'x' * 100).decode().replace('\n', '\r\n' * 20)
+        self.assertEqual(self.field.to_internal_value(wrapped).size, 100)
+        for data in ['A' * 1000, base64.encodebytes(b'x' * 101).decode().replace('\n', '\n' * 50)]:
+            with self.assertRaisesMessage(ValidationError, 'File is too large'):
+                self.field.to_internal_value(data)
+
+
+class FileDedupTest(TemporaryMediaTestCase):
+
+    def create(self, content):
+        return File.objects.create(file=ContentFile(content, name='upload'))
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def test_same_content_shares_blob(self):
+        first = self.create(PNG_BYTES)
+        second = self.create(PNG_BYTES)
+        other = self.create(b'other')
+        self.assertEqual(first.digest, hashlib.sha256(PNG_BYTES).hexdigest())
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.mime_type, 'image/png')
+        self.assertNotEqual(other.file.name, first.file.name)
+        self.assertEqual(File.objects.values('file').distinct().count(), 2)
+
+    def test_blob_moved_when_last_reference_deleted(self):
+        first = self.create(PNG_BYTES)
+        second = self.create(PNG_BYTES)
+        name = first.file.name
+        first.delete()
+        self.assertTrue(first.file.name.startswith('deleted/'))
+        self.assertTrue(self.exists(name))
+        self.assertEqual(File.objects.get(pk=second.pk).file.read(), PNG_BYTES)
+        second.delete()
+        self.assertFalse(self.exists(name))
+        self.assertTrue(self.exists(first.file.name))
+        # Deleted blobs are not reused
+        self.assertNotEqual(self.create(PNG_BYTES).file.name, name)
+
+    def test_blob_moved_by_concurrent_delete_stored_again(self):
+        first = self.create(b'content')
+        name = first.file.name
+        # Blob moved by a delete whose row update is not visible yet
+        File.discard_blob(name)
+        second = self.create(b'content')
+        self.assertNotEqual(second.file.name, name)
+        self.assertEqual(File.objects.get(pk=second.pk).file.read(), b'content')
+
+    def test_dedup_command(self):
+        files = [self.create(content) for content in [PNG_BYTES, b'other', PNG_BYTES]]
+        names = [file.file.name for file in files]
+        # Rows uploaded before digests were recorded have a blob each
+        duplicate = 'files/' + uuid.uuid4().hex
+        with open(os.path.join(self.media_root, duplicate), 'wb') as blob:
+            blob.write(PNG_BYTES)
+        File.objects.filter(pk=files[2].pk).update(file=duplicate)
+        File.objects.filter(pk__in=[file.pk for file in files]).update(digest='')
+        user = User.objects.create_user(username='tester', password='password')
+        user.profile.picture = files[2]
+        user.profile.save()
+        post = Post.objects.create(user=user, title='Title', content='Content')
+        post.attachments.add(files[2])
+        keys = [post_version_key(post.id), user_version_key(user.id)]
+
+        call_command('dedup_files', '--dry-run', stdout=open(os.devnull, 'w'))
+        self.assertEqual(File.objects.filter(digest='').count(), 3)
+        versions = get_versions(keys)
+        call_command('dedup_files', stdout=open(os.devnull, 'w'))
+        # Cached data embedding URL of the moved blob is invalidated
+        self.assertTrue(all(version > versions[key] for key, version in get_versions(keys).items()))
+        self.assertEqual(list(File.objects.order_by('id').values_list('file', flat=True)), [names[0], names[1], names[0]])
+        self.assertEqual(File.objects.filter(digest='').count(), 0)
+        self.assertFalse(self.exists(duplicate))
+        self.assertTrue(self.exists('deleted/' + duplicate.split('/')[1]))
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, IMAGE_VARIANTS={'thumb': 32, 'medium': 640}, DEBUG=False,
+                   MEDIA_NGINX_REDIRECT='/protected/')
+class ImageVariantTest(TemporaryMediaTestCase):
+
+    def create_image(self, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, format='PNG')
+        return File.objects.create(file=ContentFile(buffer.getvalue(), name='upload'))
+
+    def test_variants_smaller_than_original(self):
+        file = self.create_image((100, 50))
+        with Image.open(os.path.join(self.media_root, file.file.name + '.thumb')) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('PNG', (32, 16)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, file.file.name + '.medium')))
+
+        data = FileSerializer(file, variant='thumb').data
+        self.assertEqual(data['file'], '/media/%s.thumb' % file.file.name)
+        self.assertEqual(sorted(data['variants']), ['medium', 'original', 'thumb'])
+        self.assertEqual(data['variants']['original'], '/media/' + file.file.name)
+        other = File.objects.create(file=ContentFile(b'text', name='upload'))
+        self.assertEqual(FileSerializer(other, variant='thumb').data['variants'], {})
+
+    def test_media_falls_back_to_original(self):
+        file = self.create_image((100, 50))
+        response = self.client.get('/media/%s.thumb' % file.file.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/%s.thumb' % file.file.name)
+        self.assertEqual(response['Content-type'], 'image/png')
+        response = self.client.get('/media/%s.medium' % file.file.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + file.file.name)
+
+    def test_command_generates_missing_variants(self):
+        file = self.create_image((100, 50))
+        thumb = os.path.join(self.media_root, file.file.name + '.thumb')
+        os.remove(thumb)
+        call_command('generate_image_variants', stdout=open(os.devnull, 'w'))
+        self.assertTrue(os.path.exists(thumb))
+        with patch('core.thumbnails.Image.open', wraps=Image.open) as image_open:
+            call_command('generate_image_variants', stdout=open(os.devnull, 'w'))
+        # Only medium is missing, the original is too small for it
+        self.assertEqual(image_open.call_count, 1)
+
+    def test_variants_removed_with_blob(self):
+        file = self.create_image((100, 50))
+        name = file.file.name
+        file.delete()
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, name + '.thumb')))
+
+
+@override_settings(DEBUG=False, MEDIA_NGINX_REDIRECT='/protected/')
+class MediaMimeCacheTest(TemporaryMediaTestCase):
+
+    def test_cache_hits_skip_database(self):
+        file = File.objects.create(file=ContentFile(PNG_BYTES, name='upload'))
+        url = '/media/' + file.file.name
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url)['Content-type'], 'image/png')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['Content-type'], 'image/png')
+        # Other processes find it in shared cache
+        clear_local_caches()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['X-Accel-Redirect'], '/protected/' + file.file.name)
+
+    def test_invalidated_when_blob_deleted(self):
+        first = File.objects.create(file=ContentFile(PNG_BYTES, name='upload'))
+        second = File.objects.create(file=ContentFile(PNG_BYTES, name='upload'))
+        url = '/media/' + first.file.name
+        self.assertEqual(self.client.get(url).status_code, 200)
+        first.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        second.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get('/media/files/missing').status_code, 404)
+
+
+class BulkFileDeleteTest(TemporaryMediaTestCase):
+
+    def create(self, content):
+        return File.objects.create(file=ContentFile(content, name='upload'))
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def deleted_name(self, name):
+        return 'deleted/' + name.split('/')[1]
+
+    @override_settings(DEFERRED_BLOB_MOVES=False)
+    def test_delete_in_bulk(self):
+        files = [self.create(content) for content in [PNG_BYTES, b'one', b'two']]
+        kept = self.create(PNG_BYTES)
+        names = [file.file.name for file in files]
+        for count in [1, 2]:
+            with self.assertNumQueries(3):
+                File.objects.filter(pk__in=[file.pk for file in files[:count + 1]]).delete()
+        self.assertEqual(list(File.objects.filter(pk__in=[file.pk for file in files]).values_list('file', flat=True)),
+                         [self.deleted_name(name) for name in names])
+        self.assertEqual(File.objects.get(pk=kept.pk).file.read(), PNG_BYTES)
+        self.assertFalse(self.exists(names[1]))
+        self.assertTrue(self.exists(self.deleted_name(names[2])))
+        # Nothing left to delete
+        with self.assertNumQueries(1):
+            File.objects.filter(pk__in=[file.pk for file in files]).delete()
+
+    def test_sweep_moves_unused_blobs(self):
+        live, deleted = [self.create(content) for content in [b'live', b'deleted']]
+        # Row marked deleted whose blob move was lost
+        File.objects.filter(pk=deleted.pk).update(file=self.deleted_name(deleted.file.name))
+        call_command('sweep_blobs', '--dry-run', '--min-age=0', stdout=open(os.devnull, 'w'))
+        self.assertTrue(self.exists(deleted.file.name))
+        call_command('sweep_blobs', stdout=open(os.devnull, 'w'))
+        self.assertTrue(self.exists(deleted.file.name))
+        call_command('sweep_blobs', '--min-age=0', '--batch-size=1', stdout=open(os.devnull, 'w'))
+        self.assertFalse(self.exists(deleted.file.name))
+        self.assertTrue(self.exists(self.deleted_name(deleted.file.name)))
+        self.assertTrue(self.exists(live.file.name))
+
+    def test_worker_moves_blobs(self):
+        names = [self.create(content).file.name for content in [b'one', b'two']]
+        File.objects.filter(file__in=names).update(file=Concat(Value('deleted/'), Substr('file', 7)))
+        trash.enqueue(names + ['files/missing'])
+        trash._queue.join()
+        for name in names:
+            self.assertFalse(self.exists(name))
+            self.assertTrue(self.exists(self.deleted_name(name)))
@@ -0,0 +1,96 @@
+"""
+Resized variants of uploaded images, generated off the request path by a pool of worker threads.
+
+Variant of blob `files/<hex>` is stored next to it as `files/<hex>.<variant>`, in format of the original so mime type
+of the File row holds for it too. Variants are only generated for images larger than their size, media views fall
+back to the original for a missing variant.
+
+Worker threads need `enable-threads` under uWSGI, and queued work is lost when a worker exits. Run the
+generate_image_variants command on a schedule to produce variants missed that way.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def variant_name(name, variant):
+    return '%s.%s' % (name, variant)
+
+
+def split_variant(path):
+    """
+    Split media path into (name of original blob, variant or None)
+    """
+    name, _, variant = path.rpartition('.')
+    if name and variant in settings.IMAGE_VARIANTS:
+        return name, variant
+    return path, None
+
+
+def resolve_variant(path):
+    """
+    Get (name of original blob, path to serve) for media path, which is the original if variant isn't generated
+    """
+    name, variant = split_variant(path)
+    if variant and not os.path.exists(settings.MEDIA_ROOT + path):
+        return name, name
+    return name, path
+
+
+def generate_variants(name, force=False):
+    """
+    Generate variants of image blob `name` larger than their size, skipping variants already generated unless `force`
+    """
+    variants = {variant: size for variant, size in settings.IMAGE_VARIANTS.items()
+                if force or not os.path.exists(settings.MEDIA_ROOT + variant_name(name, variant))}
+    if not variants:
+        return
+    try:
+        with Image.open(settings.MEDIA_ROOT + name) as original:
+            # Size is read from the header, pixels are only decoded if a variant is due
+            variants = {variant: size for variant, size in variants.items() if max(original.size) > size}
+            if not variants:
+                return
+            original.load()
+            for variant, size in variants.items():
+                image = original.copy()
+                image.thumbnail((size, size), Image.ANTIALIAS)
+                # Written under a temporary name so a partial file is never served
+                path = settings.MEDIA_ROOT + variant_name(name, variant)
+                image.save(path + '.tmp', format=original.format)
+                os.rename(path + '.tmp', path)
+    except (IOError, OSError, ValueError):
+        logger.exception('Failed to generate variants of %s', name)
+
+
+def remove_variants(name):
+    for variant in settings.IMAGE_VARIANTS:
+        path = settings.MEDIA_ROOT + variant_name(name, variant)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+    return _executor
+
+
+def schedule_variants(name):
+    """
+    Generate variants of image blob `name` in worker pool once current transaction commits, or right away if
+    IMAGE_VARIANT_WORKERS is 0.
+    """
+    if not settings.IMAGE_VARIANT_WORKERS:
+        generate_variants(name)
+        return
+    transaction.on_commit(lambda: get_executor().submit(generate_variants, name))
@@ -0,0 +1,90 @@
+"""
+Moves of deleted blobs to deleted/, done by a background thread so requests deleting files don't wait on the
+filesystem. The thread moves queued blobs in batches and requeues failed moves up to MOVE_ATTEMPTS times.
+
+The queue lives in memory, moves still queued when a worker exits are lost. The sweep_blobs command moves blobs no
+live file uses and should run on a schedule.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MOVE_ATTEMPTS = 5
+RETRY_DELAY = 5
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def move_blob(name):
+    from .models import File
+    # Missing blob was moved by an earlier attempt or another process
+    if os.path.exists(settings.MEDIA_ROOT + name):
+        File.discard_blob(name)
+
+
+def move_batch(batch):
+    """
+    Move blobs of (name, attempt) pairs, returns pairs to retry
+    """
+    retry = []
+    for name, attempt in batch:
+        try:
+            move_blob(name)
+        except OSError:
+            if attempt + 1 < MOVE_ATTEMPTS:
+                retry.append((name, attempt + 1))
+            else:
+                logger.exception('Failed to move %s to deleted/', name)
+    return retry
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        retry = move_batch(batch)
+        if retry:
+            time.sleep(RETRY_DELAY)
+            for item in retry:
+                _queue.put(item)
+        for _ in batch:
+            _queue.task_done()
+
+
+def enqueue(names):
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name='blob-mover', daemon=True)
+            _worker.start()
+    for name in names:
+        _queue.put((name, 0))
+
+
+def discard_blobs(names):
+    """
+    Move blobs `names` to deleted/ in background once current transaction commits, or right away if
+    DEFERRED_BLOB_MOVES is off.
+    """
+    names = list(names)
+    if not names:
+        return
+    if not settings.DEFERRED_BLOB_MOVES:
+        for name in names:
+            move_blob(name)
+        return
+    transaction.on_commit(lambda: enqueue(names))
@@ -0,0 +1,41 @@
+"""
+Upload handlers computing SHA-256 digest of uploaded files while they stream in, set as `digest` of the uploaded file.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class DigestMemoryFileUploadHandler(MemoryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        # Set up before super(), which raises StopFutureHandlers once it takes the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.digest = self.sha256.hexdigest()
+        return file
+
+
+class DigestTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.digest = self.sha256.hexdigest()
+        return file
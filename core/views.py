@@ -1,9 +1,14 @@
+import hashlib
+
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import viewsets
 from .models import Tag
 from .serializers import TagSerializer
+from .tagindex import search_tags
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import list_route
 from rest_framework.response import Response
+from rest_framework.status import HTTP_304_NOT_MODIFIED
 
 
 class SerializerClassRequestContextMixin(object):
@@ -15,6 +20,29 @@ class SerializerClassRequestContextMixin(object):
         return klass(instance, context=context, **kwargs)
 
 
+class ConditionalResponseMixin(object):
+    """
+    Responds 304 to requests whose If-None-Match matches ETag of the response, before the body is built. ETags are
+    computed from cache versions of everything the body depends on instead of the rendered body.
+    """
+
+    def get_etag(self, *parts):
+        digest = hashlib.md5(repr((self.request.user.id,) + parts).encode()).hexdigest()
+        return quote_etag(digest)
+
+    def get_conditional_response(self, etag, get_data):
+        """
+        `get_data` returns body of the response and is called only if client doesn't have it already.
+        """
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match.strip() == '*' or parse_etags(etag)[0] in parse_etags(if_none_match)):
+            response = Response(status=HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(get_data())
+        response['ETag'] = etag
+        return response
+
+
 class TagViewset(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -23,7 +51,7 @@ class TagViewset(viewsets.ReadOnlyModelViewSet):
     @list_route()
     def search(self, request):
         """
-        Get list of tags by query
+        Get tags starting with query, most used first, followed by tags containing query
         ---
         serializer: core.serializers.TagSerializer
         parameters:
@@ -33,5 +61,5 @@ class TagViewset(viewsets.ReadOnlyModelViewSet):
 
         """
         param = request.GET.get('query', '')
-        tags = self.queryset.filter(tag__icontains=param)[:10]
+        tags = [Tag(id=pk, tag=name) for pk, name in search_tags(param)]
         return Response(TagSerializer(tags, many=True).data)
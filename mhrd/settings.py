@@ -24,6 +24,11 @@ CACHES = {
     }
 }
 
+# Seconds for which serialized posts, replies and feed pages stay in cache
+RESPONSE_CACHE_TIMEOUT = 60 * 15
+# Seconds changes stay out of delta sync, so a cursor never passes a write still committing with an older timestamp
+SYNC_CURSOR_LAG = 5
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.9/howto/deployment/checklist/
 
@@ -122,6 +127,42 @@ STATIC_URL = '/static/'
 
 MEDIA_URL = '/media/'
 
+# Largest file accepted in uploads, in bytes
+MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+
+FILE_UPLOAD_HANDLERS = [
+    'core.uploadhandlers.DigestMemoryFileUploadHandler',
+    'core.uploadhandlers.DigestTemporaryFileUploadHandler',
+]
+
+# Resized variants of uploaded images, variant -> largest side in pixels
+IMAGE_VARIANTS = {
+    'thumb': 128,
+    'medium': 640,
+}
+# Worker threads generating image variants, 0 generates them in the request
+IMAGE_VARIANT_WORKERS = 2
+
+# In-process LRU of mime types of media files, in front of the shared cache
+MEDIA_MIME_LRU_SIZE = 4096
+MEDIA_MIME_LRU_TIMEOUT = 60
+
+# Move blobs of files deleted in bulk to deleted/ in a background thread
+DEFERRED_BLOB_MOVES = True
+
+# Seconds tokens and their users stay in shared cache, entries are written through on save
+TOKEN_CACHE_TIMEOUT = 60 * 60 * 24
+# In-process LRU of tokens in front of the shared cache
+TOKEN_LOCAL_CACHE_SIZE = 10000
+TOKEN_LOCAL_CACHE_TIMEOUT = 30
+# Least seconds between writes of last_accessed of a token
+TOKEN_TOUCH_INTERVAL = 60 * 60
+# Write last_accessed of tokens in a background thread, batching times recorded in this many seconds
+DEFERRED_TOKEN_TOUCHES = True
+TOKEN_TOUCH_FLUSH_DELAY = 10
+# Active tokens kept per user, logins beyond it delete least recently used ones
+MAX_TOKENS_PER_USER = 10
+
 # Logging Configuration
 LOGGING_CONFIG = None
 LOGGING = {
@@ -196,7 +237,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'account.tokenauth.TokenAuthentication',
-    )
+    ),
+    # Clients are behind one nginx appending to X-Forwarded-For, so only its last address is trusted
+    'NUM_PROXIES': 1,
+    # Token bucket rates of signup and login routes, see account.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '30/min',
+        'auth_email': '5/hour',
+        'auth_username': '10/min',
+    },
 }
 
 from .settings_user import *  # NOQA
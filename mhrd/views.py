@@ -3,23 +3,28 @@ import posixpath
 from urllib.parse import unquote
 
 from django.conf import settings
-from django.http import FileResponse, HttpResponse
-from django.shortcuts import get_object_or_404, render_to_response
+from django.http import FileResponse, HttpResponse, Http404
+from django.shortcuts import render_to_response
 from django.views.static import serve
 
 from core.core import get_apk_url
-from core.models import File
+from core.mediacache import get_mime_type
+from core.thumbnails import resolve_variant
+
+
+def get_mime_type_or_404(name):
+    mime_type = get_mime_type(name)
+    if mime_type is None:
+        raise Http404
+    return mime_type
 
 
 def media_file_view(request, path):
+    name, path = resolve_variant(posixpath.normpath(unquote(path)).lstrip('/'))
     serve_response = serve(request, path, settings.MEDIA_ROOT)
     if not isinstance(serve_response, FileResponse):
         return serve_response
-    path = posixpath.normpath(unquote(path))
-    path = path.lstrip('/')
-    file = get_object_or_404(File, file=path)
-
-    serve_response['Content-type'] = file.mime_type
+    serve_response['Content-type'] = get_mime_type_or_404(name)
     return serve_response
 
 
@@ -27,12 +32,12 @@ def media_file_accel(request, path):
     if settings.DEBUG:
         return media_file_view(request, path)
     path = posixpath.normpath(unquote(path))
-    path = path.lstrip('/')
-    file = get_object_or_404(File, file=path)
+    name, path = resolve_variant(path.lstrip('/'))
+    mime_type = get_mime_type_or_404(name)
     response = HttpResponse()
 
     response['X-Accel-Redirect'] = os.path.join(settings.MEDIA_NGINX_REDIRECT, path)
-    response['Content-type'] = file.mime_type
+    response['Content-type'] = mime_type
     return response
 
 
@@ -0,0 +1,131 @@
+"""
+Read-through cache of serialized posts and replies.
+
+Serialized rows are shared between users and keyed by versions of the row, its author and colleges. Fields depending
+on the requesting user are merged in by the serializer after loading. Pages of filtered and get_replies are cached per
+user and keyed by versions of tags and replies they are built from.
+"""
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.cache import get_versions, bump_versions, user_version_key, tag_version_key, college_version_key
+
+
+def post_version_key(post_id):
+    return 'post:version:%d' % post_id
+
+
+def replies_version_key(post_id):
+    return 'post:replies:version:%d' % post_id
+
+
+def hot_version_key():
+    # Any vote or reply can reorder hot feeds, so one version covers all of them
+    return 'post:hot:version'
+
+
+def bump_post_versions(post, tag_ids=()):
+    """
+    Bump version of post, its replies and given tags. Call after any change visible in post or tag feeds.
+    """
+    bump_versions([post_version_key(post.id), replies_version_key(post.id)] + [tag_version_key(pk) for pk in tag_ids])
+
+
+def bump_replies_version(post_id, summary=False):
+    """
+    Bump version of replies of post. With `summary` also bump version of the post, whose data includes reply count
+    and latest reply.
+    """
+    bump_versions([replies_version_key(post_id)] + ([post_version_key(post_id)] if summary else []))
+
+
+def get_data_versions(objects, version_key):
+    """
+    Get versions cached data of `objects` depends on, those of the objects, of their authors and of colleges nested
+    in authors.
+    """
+    keys = {version_key(obj) for obj in objects} | {user_version_key(obj.user_id) for obj in objects}
+    return get_versions(keys | {college_version_key()})
+
+
+def get_serialized_data(objects, serializer_class, request, version_key, versions=None):
+    """
+    Serialize `objects` through cache. `objects` need only `pk` and `user_id` to be set, full rows are fetched for
+    cache misses only. `version_key` maps an object to version key of its cached data. `versions` can be passed if
+    already fetched by `get_data_versions`.
+    """
+    objects = list(objects)
+    model = serializer_class.Meta.model
+    if versions is None:
+        versions = get_data_versions(objects, version_key)
+    keys = OrderedDict(
+        (obj.pk, '%s:data:%d:%d:%d:%d' % (model._meta.model_name, obj.pk, versions[version_key(obj)],
+                                          versions[user_version_key(obj.user_id)], versions[college_version_key()]))
+        for obj in objects
+    )
+
+    cached = cache.get_many(list(keys.values()))
+    missing = [pk for pk, key in keys.items() if key not in cached]
+    if missing:
+        rows = serializer_class.setup_eager_loading(model.objects.all()).in_bulk(missing)
+        rows = [rows[pk] for pk in missing]
+        context = {'request': request, 'shared': True}
+        fresh = {keys[row.pk]: data for row, data in zip(rows, serializer_class(rows, many=True, context=context).data)}
+        cache.set_many(fresh, settings.RESPONSE_CACHE_TIMEOUT)
+        cached.update(fresh)
+
+    data = [dict(cached[key]) for key in keys.values()]
+    serializer_class.merge_user_fields(data, objects, request.user)
+    return data
+
+
+def post_data_version_key(post):
+    return post_version_key(post.pk)
+
+
+def reply_data_version_key(reply):
+    return replies_version_key(reply.post_id)
+
+
+def get_posts_versions(posts):
+    return get_data_versions(posts, post_data_version_key)
+
+
+def get_replies_versions(replies):
+    return get_data_versions(replies, reply_data_version_key)
+
+
+def get_posts_data(posts, request, versions=None):
+    from .serializers import PostSerializer
+    return get_serialized_data(posts, PostSerializer, request, post_data_version_key, versions)
+
+
+def get_replies_data(replies, request, versions=None):
+    from .serializers import ReplySerializer
+    return get_serialized_data(replies, ReplySerializer, request, reply_data_version_key, versions)
+
+
+def get_cached_page(key, params, versions, build_page):
+    """
+    Get page cached under `key` for request `params` and dict of `versions`. `build_page` returns
+    (objects, next link, previous link) on miss. Returns (list of (pk, user_id), next link, previous link).
+    """
+    digest = hashlib.md5(repr((sorted(params.items()), sorted(versions.items()))).encode()).hexdigest()
+    key = '%s:%s' % (key, digest)
+    page = cache.get(key)
+    if page is None:
+        objects, next_link, previous_link = build_page()
+        page = ([(obj.pk, obj.user_id) for obj in objects], next_link, previous_link)
+        cache.set(key, page, settings.RESPONSE_CACHE_TIMEOUT)
+    return page
+
+
+def get_paginated_data(results, next_link, previous_link):
+    return OrderedDict([
+        ('next', next_link),
+        ('previous', previous_link),
+        ('results', results),
+    ])
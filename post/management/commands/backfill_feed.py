@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from college.models import College
+from post.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild feed entries of colleges from their tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('college_ids', nargs='*', type=int, help='Colleges to rebuild, all if not given')
+
+    def handle(self, *args, **options):
+        colleges = College.objects.all()
+        if options['college_ids']:
+            colleges = colleges.filter(pk__in=options['college_ids'])
+        for college in colleges:
+            FeedEntry.rebuild_college(college)
+            self.stdout.write('%s: %d entries' % (college, FeedEntry.objects.filter(college=college).count()))
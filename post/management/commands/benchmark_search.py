@@ -0,0 +1,74 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from post.search import CREATE_TABLE_SQL, SEARCH_SQL, to_match_query
+
+
+class Command(BaseCommand):
+    help = 'Benchmark post search against a LIKE scan on a synthetic SQLite database, the project database is untouched'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--words', type=int, default=20000, help='Size of vocabulary')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def timed(self, function, *args):
+        start = time.time()
+        result = function(*args)
+        return result, time.time() - start
+
+    def create_posts(self, db, vocabulary, count):
+        def text(length):
+            return ' '.join(random.choice(vocabulary) for _ in range(length))
+
+        batch_size = 10000
+        for start in range(0, count, batch_size):
+            db.executemany(
+                'INSERT INTO post_post (id, user_id, title, content, visibility) VALUES (?, ?, ?, ?, ?)',
+                [(pk, random.randint(1, 1000), text(6), text(40), random.choice('0001'))
+                 for pk in range(start + 1, min(start + batch_size, count) + 1)]
+            )
+        db.commit()
+
+    def build_index(self, db):
+        db.execute(CREATE_TABLE_SQL)
+        db.execute("INSERT INTO post_post_fts (rowid, title, content) SELECT id, title, content FROM post_post")
+        db.commit()
+
+    def run_queries(self, db, sql, params_list):
+        for params in params_list:
+            db.execute(sql, params).fetchall()
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        vocabulary = ['word%d' % index for index in range(options['words'])]
+        directory = tempfile.mkdtemp()
+        try:
+            db = sqlite3.connect(os.path.join(directory, 'benchmark.sqlite3'))
+            db.execute('CREATE TABLE post_post (id integer PRIMARY KEY, user_id integer, title varchar(256), '
+                       'content text, visibility varchar(1))')
+            _, elapsed = self.timed(self.create_posts, db, vocabulary, options['posts'])
+            self.stdout.write('Created %d posts in %.1fs' % (options['posts'], elapsed))
+            _, elapsed = self.timed(self.build_index, db)
+            self.stdout.write('Built index in %.1fs' % elapsed)
+
+            words = [random.sample(vocabulary, 2) for _ in range(options['queries'])]
+            search_params = [(to_match_query(' '.join(pair)), 1, 20, 0) for pair in words]
+            _, elapsed = self.timed(self.run_queries, db, SEARCH_SQL.replace('%s', '?'), search_params)
+            self.stdout.write('FTS5 search: %.2fms per query' % (elapsed * 1000 / options['queries']))
+
+            like_sql = ('SELECT id, user_id FROM post_post WHERE (title LIKE ? OR content LIKE ?) '
+                        'AND (title LIKE ? OR content LIKE ?) LIMIT 20')
+            like_params = [('%%%s%%' % a, '%%%s%%' % a, '%%%s%%' % b, '%%%s%%' % b) for a, b in words]
+            _, elapsed = self.timed(self.run_queries, db, like_sql, like_params)
+            self.stdout.write('LIKE scan: %.2fms per query' % (elapsed * 1000 / options['queries']))
+            db.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
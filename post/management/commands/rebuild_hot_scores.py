@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute hot scores of posts and feed entries from vote and reply counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(post_ids), batch_size):
+            with transaction.atomic():
+                Post.update_hot(post_ids[start:start + batch_size])
+        self.stdout.write('Updated %d posts' % len(post_ids))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from post.search import is_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild full-text search index of posts'
+
+    def handle(self, *args, **options):
+        if not is_available():
+            self.stderr.write('Search index is only supported on SQLite with FTS5')
+            return
+        self.stdout.write('Indexed %d posts' % rebuild_index())
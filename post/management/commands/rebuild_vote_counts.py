@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from post.models import Post, Reply, Vote, VOTE_UP, VOTE_DOWN
+
+
+class Command(BaseCommand):
+    help = 'Rebuild upvote_count/downvote_count of posts and replies from votes and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report drift, do not fix counters')
+
+    def get_counts(self, model, value):
+        fk_name = model._meta.model_name
+        votes = Vote.objects.filter(value=value, **{fk_name + '__isnull': False})
+        counts = votes.values(fk_name).annotate(total=Count('id')).order_by()
+        return {row[fk_name]: row['total'] for row in counts}
+
+    def rebuild(self, model, dry_run):
+        upvotes = self.get_counts(model, VOTE_UP)
+        downvotes = self.get_counts(model, VOTE_DOWN)
+        drifted = []
+        for pk, upvote_count, downvote_count in model.objects.values_list('id', 'upvote_count', 'downvote_count'):
+            expected = (upvotes.get(pk, 0), downvotes.get(pk, 0))
+            if expected != (upvote_count, downvote_count):
+                drifted.append((pk, expected))
+                self.stdout.write('%s %d: stored %d/%d, actual %d/%d' % (
+                    model.__name__, pk, upvote_count, downvote_count, expected[0], expected[1]))
+
+        if not dry_run:
+            with transaction.atomic():
+                for pk, expected in drifted:
+                    model.objects.filter(pk=pk).update(upvote_count=expected[0], downvote_count=expected[1],
+                                                       modified=timezone.now())
+                model.votes_changed([pk for pk, expected in drifted])
+        return len(drifted)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        for model in [Post, Reply]:
+            drifted = self.rebuild(model, dry_run)
+            action = 'found' if dry_run else 'fixed'
+            self.stdout.write('%s: %s %d drifted rows' % (model.__name__, action, drifted))
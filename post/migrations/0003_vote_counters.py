@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_vote_counters(apps, schema_editor):
+    for model_name in ['Post', 'Reply']:
+        model = apps.get_model('post', model_name)
+        fk_name = model._meta.model_name
+        for field_name in ['upvotes', 'downvotes']:
+            through = getattr(model, field_name).through
+            counts = through.objects.values(fk_name).annotate(total=Count('id')).order_by()
+            for row in counts:
+                model.objects.filter(pk=row[fk_name]).update(**{field_name[:-1] + '_count': row['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0002_auto_20151218_2156'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='downvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='upvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='downvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='upvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_vote_counters, migrations.RunPython.noop),
+    ]
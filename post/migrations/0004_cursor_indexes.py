@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0003_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='post',
+            index_together=set([('user', 'visibility', 'created'), ('visibility', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reply',
+            index_together=set([('post', 'visibility', 'created')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('college', '0005_auto_20151217_1629'),
+        ('post', '0004_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('college', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='college.College')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='post.Post')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='feedentry',
+            unique_together=set([('college', 'post')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='feedentry',
+            index_together=set([('college', 'created')]),
+        ),
+    ]
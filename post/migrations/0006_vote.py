@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:21
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def copy_votes(apps, schema_editor):
+    Vote = apps.get_model('post', 'Vote')
+    for model_name in ['Post', 'Reply']:
+        model = apps.get_model('post', model_name)
+        fk_name = model._meta.model_name + '_id'
+        votes = {}
+        # Downvotes are copied last, so they win for users present in both tables
+        for field_name, value in [('upvotes', 1), ('downvotes', -1)]:
+            through = getattr(model, field_name).through
+            for user_id, object_id in through.objects.values_list('user_id', fk_name).iterator():
+                votes[(user_id, object_id)] = value
+        Vote.objects.bulk_create([
+            Vote(user_id=user_id, value=value, **{fk_name: object_id})
+            for (user_id, object_id), value in votes.items()
+        ])
+
+        # Counters may have counted users present in both tables, so recount
+        model.objects.update(upvote_count=0, downvote_count=0)
+        for value, counter in [(1, 'upvote_count'), (-1, 'downvote_count')]:
+            counts = Vote.objects.filter(value=value, **{fk_name + '__isnull': False})
+            for row in counts.values(fk_name).annotate(total=Count('id')).order_by():
+                model.objects.filter(pk=row[fk_name]).update(**{counter: row['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('post', '0005_college_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.SmallIntegerField(choices=[[1, 'Upvote'], [-1, 'Downvote']])),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='post.Post')),
+                ('reply', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='post.Reply')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('user', 'post'), ('user', 'reply')]),
+        ),
+        migrations.RunPython(copy_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:22
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0006_vote'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='post',
+            name='downvotes',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='upvotes',
+        ),
+        migrations.RemoveField(
+            model_name='reply',
+            name='downvotes',
+        ),
+        migrations.RemoveField(
+            model_name='reply',
+            name='upvotes',
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:25
+from __future__ import unicode_literals
+
+from django.db import migrations
+import post.models
+
+# Partial indexes over visible and hidden content, Django doesn't support declaring them on models.
+LIVE_CONTENT_INDEXES = [
+    ('post_post_live_created', 'post_post', 'created'),
+    ('post_post_live_user_created', 'post_post', 'user_id, created'),
+    ('post_reply_live_post_created', 'post_reply', 'post_id, created'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0007_remove_vote_m2m'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='post',
+            index_together=set([]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reply',
+            index_together=set([]),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='visibility',
+            field=post.models.VisibilityField(choices=[['2', 'Deleted'], ['1', 'Hidden'], ['0', 'Visible']], default='0', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='reply',
+            name='visibility',
+            field=post.models.VisibilityField(choices=[['2', 'Deleted'], ['1', 'Hidden'], ['0', 'Visible']], default='0', max_length=1),
+        ),
+    ] + [
+        migrations.RunSQL(
+            ["CREATE INDEX %s ON %s (%s) WHERE visibility IN ('0', '1')" % (name, table, columns)],
+            ['DROP INDEX %s' % name],
+        )
+        for name, table, columns in LIVE_CONTENT_INDEXES
+    ]
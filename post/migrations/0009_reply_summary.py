@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_reply_summaries(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    Reply = apps.get_model('post', 'Reply')
+    replies = Reply.objects.filter(visibility='0').order_by('post_id', 'created', 'id')
+    summaries = {}
+    for post_id, reply_id in replies.values_list('post_id', 'id').iterator():
+        count, _ = summaries.get(post_id, (0, None))
+        summaries[post_id] = (count + 1, reply_id)
+    for post_id, (count, reply_id) in summaries.items():
+        Post.objects.filter(pk=post_id).update(reply_count=count, last_reply=reply_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0008_live_content_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='last_reply',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='post.Reply'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_reply_summaries, migrations.RunPython.noop),
+    ]
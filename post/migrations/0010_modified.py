@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def populate_modified(apps, schema_editor):
+    for model_name in ['Post', 'Reply']:
+        apps.get_model('post', model_name).objects.update(modified=F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0009_reply_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_modified, migrations.RunPython.noop),
+    ]
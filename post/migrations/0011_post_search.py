@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:42
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_search_index(apps, schema_editor):
+    # Without FTS5 posts are searched without index, rebuild_search_index creates it once SQLite supports FTS5
+    if schema_editor.connection.vendor != 'sqlite' or not has_fts5(schema_editor.connection):
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE post_post_fts USING fts5(title, content, tokenize='unicode61')")
+    schema_editor.execute("INSERT INTO post_post_fts (rowid, title, content) "
+                          "SELECT id, title, content FROM post_post WHERE visibility != '2'")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS post_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0010_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 10:47
+from __future__ import unicode_literals
+
+import math
+
+from django.db import migrations, models
+
+# Copy of post.models.hot_score at this migration, so later changes of the formula leave it alone
+HOT_REPLY_WEIGHT = 2
+HOT_DECAY_SECONDS = 45000
+HOT_EPOCH = 1450000000
+
+
+def hot_score(upvotes, downvotes, reply_count, created):
+    engagement = upvotes - downvotes + HOT_REPLY_WEIGHT * reply_count
+    sign = (engagement > 0) - (engagement < 0)
+    return round(sign * math.log10(max(abs(engagement), 1)) + (created.timestamp() - HOT_EPOCH) / HOT_DECAY_SECONDS, 7)
+
+
+def populate_hot(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    FeedEntry = apps.get_model('post', 'FeedEntry')
+    rows = Post.objects.values_list('id', 'upvote_count', 'downvote_count', 'reply_count', 'created')
+    for pk, upvotes, downvotes, reply_count, created in rows.iterator():
+        hot = hot_score(upvotes, downvotes, reply_count, created)
+        Post.objects.filter(pk=pk).update(hot=hot)
+        FeedEntry.objects.filter(post=pk).update(hot=hot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0011_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedentry',
+            name='hot',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='feedentry',
+            index_together=set([('college', 'created'), ('college', 'hot')]),
+        ),
+        migrations.RunPython(populate_hot, migrations.RunPython.noop),
+        migrations.RunSQL(
+            ["CREATE INDEX post_post_live_hot ON post_post (hot) WHERE visibility IN ('0', '1')"],
+            ['DROP INDEX post_post_live_hot'],
+        ),
+    ]
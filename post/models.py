@@ -1,6 +1,14 @@
-from django.db import models
+import math
+
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models import F, Q, Lookup, Case, When, Value, IntegerField, FloatField
+from django.db.models.signals import m2m_changed, post_init, post_migrate, post_save
 from django.contrib.auth.models import User
+from django.utils import timezone
+from college.models import College
+from core.cache import bump_versions
 from core.models import Tag, File
+from .cache import hot_version_key, post_version_key
 
 
 CONTENT_VISIBLE = '0'
@@ -12,27 +20,419 @@ CONTENT_VISIBILITY = [
     [CONTENT_VISIBLE, 'Visible']
 ]
 
+CONTENT_LIVE = [CONTENT_VISIBLE, CONTENT_HIDDEN]
+
+VOTE_UP = 1
+VOTE_DOWN = -1
+VOTE_NONE = 0
+
+# A reply counts as much as this many upvotes towards hotness
+HOT_REPLY_WEIGHT = 2
+# Posts this much newer rank same as posts with ten times the engagement
+HOT_DECAY_SECONDS = 45000
+HOT_EPOCH = 1450000000
+# Posts whose scores update_hot writes per UPDATE
+HOT_UPDATE_BATCH_SIZE = 300
+
+
+def hot_score(upvotes, downvotes, reply_count, created):
+    """
+    Log of engagement plus creation time scaled by HOT_DECAY_SECONDS. Decay comes from newer posts starting with
+    higher scores, so the score of a post changes only with its own engagement and never has to be decayed in place.
+    """
+    engagement = upvotes - downvotes + HOT_REPLY_WEIGHT * reply_count
+    sign = (engagement > 0) - (engagement < 0)
+    return round(sign * math.log10(max(abs(engagement), 1)) + (created.timestamp() - HOT_EPOCH) / HOT_DECAY_SECONDS, 7)
+
+
+class LiveContentLookup(Lookup):
+    """
+    `visibility__live=True` matches visible and hidden content, other values raise ValueError, exclude() it to match
+    deleted content. Values are rendered as literals, SQLite can't match partial indexes against bound parameters.
+    """
+    lookup_name = 'live'
+
+    def __init__(self, lhs, rhs):
+        if rhs is not True:
+            raise ValueError('visibility__live only accepts True')
+        super().__init__(lhs, rhs)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        return '%s IN (%s)' % (lhs, ', '.join("'%s'" % value for value in CONTENT_LIVE)), params
+
+
+class VisibilityField(models.CharField):
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 1)
+        kwargs.setdefault('choices', CONTENT_VISIBILITY)
+        kwargs.setdefault('default', CONTENT_VISIBLE)
+        super(VisibilityField, self).__init__(*args, **kwargs)
+
+VisibilityField.register_lookup(LiveContentLookup)
+
+
+def visible_to_q(user, prefix=''):
+    """
+    Condition for content visible to user: visible content and hidden content of user. The `live` term matches the
+    partial indexes over live content, so that the owner check is only a filter on index rows.
+    """
+    owner_q = Q(**{prefix + 'visibility': CONTENT_VISIBLE}) | Q(**{prefix + 'user': user})
+    return Q(**{prefix + 'visibility__live': True}) & owner_q
+
+
+class VisibilityManager(models.Manager):
+
+    class VisibilityQueryset(models.query.QuerySet):
+
+        def visible_to(self, user):
+            return self.filter(visible_to_q(user))
+
+        def latest_id(self):
+            return self.order_by('-created', '-id').values_list('id', flat=True).first()
+
+    def get_queryset(self):
+        return self.VisibilityQueryset(self.model, using=self._db)
+
+    def visible_to(self, user):
+        return self.get_queryset().visible_to(user)
+
+
+VOTE_WRITE_ATTEMPTS = 3
+# Rows set_votes writes per query, counters bind up to 5 parameters per row and SQLite before 3.32 at most 999
+VOTE_BATCH_SIZE = 150
+
+
+def insert_votes(votes, attempt):
+    """
+    Insert votes in a savepoint. Returns False when a concurrent request of same user inserted one of them first, so
+    that caller reads votes again and applies its change relative to them, unless it's the last attempt.
+    """
+    try:
+        with transaction.atomic():
+            Vote.objects.bulk_create(votes)
+    except IntegrityError:
+        if attempt == VOTE_WRITE_ATTEMPTS - 1:
+            raise
+        return False
+    return True
+
+
+class VotableModel(models.Model):
+    """
+    Keeps denormalized counters of votes so that serializing a row doesn't need COUNT queries.
+    """
+    upvote_count = models.IntegerField(default=0)
+    downvote_count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_user_votes(cls, user, ids):
+        """
+        Get votes of user on rows with given ids as dict of id -> vote. Rows not voted on are left out.
+        """
+        fk_name = cls._meta.model_name + '_id'
+        votes = Vote.objects.filter(user=user, **{fk_name + '__in': ids})
+        return dict(votes.values_list(fk_name, 'value'))
+
+    def get_user_vote(self, user):
+        return self.get_user_votes(user, [self.pk]).get(self.pk, VOTE_NONE)
+
+    def set_vote(self, user, value):
+        """
+        Set vote of user to one of VOTE_UP, VOTE_DOWN or VOTE_NONE and update counters in same transaction.
+        """
+        with transaction.atomic():
+            votes = Vote.objects.filter(user=user, **{self._meta.model_name: self})
+            for attempt in range(VOTE_WRITE_ATTEMPTS):
+                old_value = votes.values_list('value', flat=True).first() or VOTE_NONE
+                if old_value == value:
+                    return
+                if value == VOTE_NONE:
+                    votes.delete()
+                elif old_value != VOTE_NONE:
+                    votes.update(value=value)
+                elif not insert_votes([Vote(user=user, value=value, **{self._meta.model_name: self})], attempt):
+                    continue
+                break
+
+            self.__class__.objects.filter(pk=self.pk).update(
+                upvote_count=F('upvote_count') + (value == VOTE_UP) - (old_value == VOTE_UP),
+                downvote_count=F('downvote_count') + (value == VOTE_DOWN) - (old_value == VOTE_DOWN),
+                modified=timezone.now(),
+            )
+            self.votes_changed([self.pk])
+        self.refresh_from_db(fields=['upvote_count', 'downvote_count', 'modified'])
 
-class Post(models.Model):
+    @classmethod
+    def votes_changed(cls, ids):
+        """
+        Called after counters of rows with given ids change, in same transaction.
+        """
+        pass
+
+    @classmethod
+    def set_votes(cls, user, values):
+        """
+        Bulk version of `set_vote` taking dict of row id -> vote value, rows must exist. Votes are written with one
+        query per kind of change and counters with one UPDATE, per VOTE_BATCH_SIZE rows. Returns ids of rows whose
+        votes changed. Call inside a transaction.
+        """
+        items = list(values.items())
+        changed = []
+        for start in range(0, len(items), VOTE_BATCH_SIZE):
+            changed += cls._set_votes(user, dict(items[start:start + VOTE_BATCH_SIZE]))
+        return changed
+
+    @classmethod
+    def _set_votes(cls, user, values):
+        fk_name = cls._meta.model_name + '_id'
+        votes = Vote.objects.filter(user=user, **{fk_name + '__in': list(values)})
+        for attempt in range(VOTE_WRITE_ATTEMPTS):
+            old_values = dict(votes.values_list(fk_name, 'value'))
+            created, updated, deleted, deltas = [], {}, [], {}
+            for pk, value in values.items():
+                old_value = old_values.get(pk, VOTE_NONE)
+                if old_value == value:
+                    continue
+                if value == VOTE_NONE:
+                    deleted.append(pk)
+                elif old_value == VOTE_NONE:
+                    created.append(Vote(user=user, value=value, **{fk_name: pk}))
+                else:
+                    updated.setdefault(value, []).append(pk)
+                deltas[pk] = ((value == VOTE_UP) - (old_value == VOTE_UP),
+                              (value == VOTE_DOWN) - (old_value == VOTE_DOWN))
+            # Inserts go first so that nothing is written yet when they conflict and votes are read again
+            if not created or insert_votes(created, attempt):
+                break
+
+        if deleted:
+            votes.filter(**{fk_name + '__in': deleted}).delete()
+        for value, pks in updated.items():
+            votes.filter(**{fk_name + '__in': pks}).update(value=value)
+        if deltas:
+            def delta_case(index):
+                whens = [When(pk=pk, then=Value(delta[index])) for pk, delta in deltas.items() if delta[index]]
+                return Case(*whens, default=Value(0), output_field=IntegerField())
+            cls.objects.filter(pk__in=list(deltas)).update(
+                upvote_count=F('upvote_count') + delta_case(0),
+                downvote_count=F('downvote_count') + delta_case(1),
+                modified=timezone.now(),
+            )
+            cls.votes_changed(list(deltas))
+        return list(deltas)
+
+
+class Post(VotableModel):
 
     user = models.ForeignKey(User, related_name='posts')
     title = models.CharField(max_length=256)
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    # Updates bypassing save() have to set it explicitly
+    modified = models.DateTimeField(auto_now=True, db_index=True)
     tags = models.ManyToManyField(Tag, blank=True)
     anonymous = models.BooleanField(default=False)
-    visibility = models.CharField(max_length=1, choices=CONTENT_VISIBILITY, default=CONTENT_VISIBLE)
+    visibility = VisibilityField()
     attachments = models.ManyToManyField(File, blank=True)
-    upvotes = models.ManyToManyField(User, related_name='post_upvotes', blank=True)
-    downvotes = models.ManyToManyField(User, related_name='post_downvotes', blank=True)
+    # Summary of visible replies, kept up to date by reply_changed
+    reply_count = models.IntegerField(default=0)
+    last_reply = models.ForeignKey('Reply', null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    # See hot_score, kept up to date by save and update_hot
+    hot = models.FloatField(default=0)
+
+    objects = VisibilityManager()
+
+    def save(self, *args, **kwargs):
+        # Saves of edited fields only leave hot to update_hot, counters in memory may be stale
+        if kwargs.get('update_fields') is None:
+            self.hot = hot_score(self.upvote_count, self.downvote_count, self.reply_count,
+                                 self.created or timezone.now())
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def update_hot(cls, post_ids):
+        """
+        Recompute hot scores of given posts and their feed entries from stored counters. Call inside a transaction.
+        """
+        post_ids = list(post_ids)
+        if not post_ids:
+            return
+        # Each post binds 3 parameters, SQLite before 3.32 binds at most 999
+        for start in range(0, len(post_ids), HOT_UPDATE_BATCH_SIZE):
+            rows = cls.objects.filter(pk__in=post_ids[start:start + HOT_UPDATE_BATCH_SIZE])
+            scores = {pk: hot_score(*values) for pk, *values in rows.values_list(
+                'id', 'upvote_count', 'downvote_count', 'reply_count', 'created')}
+            if not scores:
+                continue
+
+            def score_case(field_name):
+                whens = [When(**{field_name: pk, 'then': Value(score)}) for pk, score in scores.items()]
+                return Case(*whens, output_field=FloatField())
+            cls.objects.filter(pk__in=list(scores)).update(hot=score_case('pk'))
+            FeedEntry.objects.filter(post__in=list(scores)).update(hot=score_case('post'))
+        bump_versions([hot_version_key()])
 
+    @classmethod
+    def votes_changed(cls, ids):
+        cls.update_hot(ids)
 
-class Reply(models.Model):
+    @classmethod
+    def reply_changed(cls, reply, was_visible):
+        """
+        Update reply summary of post of `reply` after the reply is added or its visibility changes. `was_visible`
+        tells if the reply was counted before the change.
+        """
+        is_visible = reply.visibility == CONTENT_VISIBLE
+        if is_visible == was_visible:
+            return
+        posts = cls.objects.filter(pk=reply.post_id)
+        with transaction.atomic():
+            if is_visible:
+                posts.update(reply_count=F('reply_count') + 1, last_reply=reply, modified=timezone.now())
+            else:
+                posts.update(reply_count=F('reply_count') - 1, modified=timezone.now())
+                latest = Reply.objects.filter(post_id=reply.post_id, visibility=CONTENT_VISIBLE).latest_id()
+                posts.filter(last_reply=reply).update(last_reply=latest)
+            cls.update_hot([reply.post_id])
+
+    @classmethod
+    def rebuild_reply_summaries(cls, post_ids):
+        """
+        Recount reply summaries of given posts from replies, for rows created without going through views.
+        """
+        with transaction.atomic():
+            for post_id in post_ids:
+                replies = Reply.objects.filter(post_id=post_id, visibility=CONTENT_VISIBLE)
+                cls.objects.filter(pk=post_id).update(reply_count=replies.count(), last_reply=replies.latest_id(),
+                                                      modified=timezone.now())
+            cls.update_hot(post_ids)
+
+
+class Reply(VotableModel):
     user = models.ForeignKey(User, related_name='comments')
     content = models.TextField()
     post = models.ForeignKey(Post, related_name='replies')
     created = models.DateTimeField(auto_now_add=True)
-    upvotes = models.ManyToManyField(User, related_name='comment_upvotes', blank=True)
-    downvotes = models.ManyToManyField(User, related_name='comment_downvotes', blank=True)
-    visibility = models.CharField(max_length=1, choices=CONTENT_VISIBILITY, default=CONTENT_VISIBLE)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    visibility = VisibilityField()
+
+    objects = VisibilityManager()
+
+
+class Vote(models.Model):
+    """
+    Vote of a user on either a post or a reply.
+    """
+    user = models.ForeignKey(User, related_name='votes')
+    post = models.ForeignKey(Post, null=True, blank=True, related_name='votes')
+    reply = models.ForeignKey(Reply, null=True, blank=True, related_name='votes')
+    value = models.SmallIntegerField(choices=[[VOTE_UP, 'Upvote'], [VOTE_DOWN, 'Downvote']])
+
+    class Meta:
+        unique_together = [
+            ['user', 'post'],
+            ['user', 'reply'],
+        ]
+
+
+class FeedEntry(models.Model):
+    """
+    Fan-out of posts to feeds of colleges following any of their tags, so that reading a college feed is a
+    range scan over (college, created) instead of a join over tags.
+    """
+    college = models.ForeignKey(College, related_name='feed_entries')
+    post = models.ForeignKey(Post, related_name='feed_entries')
+    created = models.DateTimeField()
+    hot = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [
+            ['college', 'post'],
+        ]
+        index_together = [
+            ['college', 'created'],
+            ['college', 'hot'],
+        ]
+
+    @classmethod
+    def update_post(cls, post):
+        """
+        Sync feed entries of post with its tags and visibility.
+        """
+        with transaction.atomic():
+            cls.objects.filter(post=post).delete()
+            if post.visibility == CONTENT_DELETED:
+                return
+            # Score of post in memory may be older than one update_hot wrote after it was loaded
+            hot = Post.objects.select_for_update().filter(pk=post.pk).values_list('hot', flat=True).first()
+            college_ids = College.objects.filter(tags__post=post).values_list('id', flat=True).distinct()
+            cls.objects.bulk_create([cls(college_id=college_id, post=post, created=post.created, hot=hot)
+                                     for college_id in college_ids])
+
+    @classmethod
+    def rebuild_college(cls, college):
+        """
+        Rebuild whole feed of college, required when tags of college change.
+        """
+        posts = Post.objects.filter(tags__college=college).exclude(visibility=CONTENT_DELETED)
+        posts = posts.values_list('id', 'created', 'hot').distinct()
+        with transaction.atomic():
+            cls.objects.filter(college=college).delete()
+            cls.objects.bulk_create([cls(college=college, post_id=post_id, created=created, hot=hot)
+                                     for post_id, created, hot in posts.iterator()])
+
+
+def college_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        # Colleges were added to or removed from a tag
+        colleges = College.objects.filter(pk__in=pk_set) if pk_set else College.objects.all()
+    else:
+        colleges = [instance]
+    for college in colleges:
+        FeedEntry.rebuild_college(college)
+
+m2m_changed.connect(college_tags_changed, sender=College.tags.through)
+
+
+def remember_username(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred username isn't loaded
+    instance._loaded_username = instance.__dict__.get('username')
+
+
+def user_renamed(sender, instance, created, **kwargs):
+    # Cached posts show username of author of their latest reply
+    loaded_username, instance._loaded_username = getattr(instance, '_loaded_username', None), instance.username
+    if created or loaded_username == instance.username:
+        return
+    post_ids = Post.objects.filter(last_reply__user=instance).values_list('id', flat=True)
+    bump_versions([post_version_key(post_id) for post_id in post_ids])
+
+post_init.connect(remember_username, sender=User)
+post_save.connect(user_renamed, sender=User)
+
+# Partial indexes over live content backing `visible_to_q`, as (name, table, columns)
+LIVE_CONTENT_INDEXES = [
+    ('post_post_live_created', 'post_post', 'created'),
+    ('post_post_live_user_created', 'post_post', 'user_id, created'),
+    ('post_reply_live_post_created', 'post_reply', 'post_id, created'),
+    ('post_post_live_hot', 'post_post', 'hot'),
+]
+
+
+def create_live_content_indexes(sender, using, **kwargs):
+    # Migrations remaking a table on SQLite drop indexes unknown to Django, so restore them after every migrate
+    if sender.name != 'post':
+        return
+    with connections[using].cursor() as cursor:
+        for name, table, columns in LIVE_CONTENT_INDEXES:
+            cursor.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s) WHERE visibility IN ('%s', '%s')" % (
+                name, table, columns, CONTENT_VISIBLE, CONTENT_HIDDEN))
 
+post_migrate.connect(create_live_content_indexes)
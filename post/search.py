@@ -0,0 +1,104 @@
+"""
+Full-text search of posts backed by an SQLite FTS5 table, whose rowid is id of the post. Deleted posts are left out of
+the index, other visibility rules are applied when searching. On other databases and SQLite builds without FTS5 there
+is no index and posts containing all words are searched with `icontains`, newest first.
+"""
+import re
+import sqlite3
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Post, CONTENT_VISIBLE, CONTENT_HIDDEN, CONTENT_DELETED
+
+CREATE_TABLE_SQL = "CREATE VIRTUAL TABLE IF NOT EXISTS post_post_fts USING fts5(title, content, tokenize='unicode61')"
+
+# Matches in title weigh more than matches in content
+RANK_SQL = 'bm25(post_post_fts, 4.0, 1.0)'
+
+SEARCH_SQL = (
+    'SELECT post_post.id, post_post.user_id FROM post_post_fts '
+    'JOIN post_post ON post_post.id = post_post_fts.rowid '
+    "WHERE post_post_fts MATCH %%s AND post_post.visibility IN ('%s', '%s') "
+    "AND (post_post.visibility = '%s' OR post_post.user_id = %%s) "
+    'ORDER BY %s LIMIT %%s OFFSET %%s'
+) % (CONTENT_VISIBLE, CONTENT_HIDDEN, CONTENT_VISIBLE, RANK_SQL)
+
+
+_fts5 = None
+
+
+def has_fts5():
+    """
+    Check if the SQLite library is built with FTS5, on a separate in-memory database so no query is made on the
+    Django connection.
+    """
+    global _fts5
+    if _fts5 is None:
+        database = sqlite3.connect(':memory:')
+        try:
+            _fts5 = ('ENABLE_FTS5',) in database.execute('PRAGMA compile_options').fetchall()
+        finally:
+            database.close()
+    return _fts5
+
+
+def is_available():
+    return connection.vendor == 'sqlite' and has_fts5()
+
+
+def index_post(post):
+    """
+    Add, update or remove post from index according to its current title, content and visibility.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM post_post_fts WHERE rowid = %s', [post.id])
+        if post.visibility != CONTENT_DELETED:
+            cursor.execute('INSERT INTO post_post_fts (rowid, title, content) VALUES (%s, %s, %s)',
+                           [post.id, post.title, post.content])
+
+
+def rebuild_index():
+    """
+    Rebuild whole index from posts, returns number of posts indexed.
+    """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        cursor.execute('DELETE FROM post_post_fts')
+        cursor.execute('INSERT INTO post_post_fts (rowid, title, content) '
+                       'SELECT id, title, content FROM post_post WHERE visibility != %s', [CONTENT_DELETED])
+        return cursor.rowcount
+
+
+def to_match_query(text):
+    """
+    Turn free text into FTS5 query matching rows containing all its words. Words are quoted so that user input can't
+    use FTS5 query syntax.
+    """
+    return ' '.join('"%s"' % word for word in re.findall(r'\w+', text))
+
+
+def search_posts(user, text, offset, limit):
+    """
+    Get posts visible to user matching words of `text`, best match first. Posts have only `pk` and `user_id` loaded.
+    """
+    query = to_match_query(text)
+    if not query:
+        return []
+    if not is_available():
+        return search_posts_without_index(user, text, offset, limit)
+    return list(Post.objects.raw(SEARCH_SQL, [query, user.id, limit, offset]))
+
+
+def search_posts_without_index(user, text, offset, limit):
+    """
+    Get posts visible to user containing all words of `text` in title or content, newest first.
+    """
+    posts = Post.objects.filter(Q(visibility=CONTENT_VISIBLE) | Q(visibility=CONTENT_HIDDEN, user=user))
+    for word in re.findall(r'\w+', text):
+        posts = posts.filter(Q(title__icontains=word) | Q(content__icontains=word))
+    return list(posts.order_by('-created', '-id').only('id', 'user_id')[offset:offset + limit])
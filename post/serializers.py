@@ -1,47 +1,124 @@
 from rest_framework import serializers
-from .models import Post, Reply
+from rest_framework.utils import html
+from django.db import models
+from django.utils.text import Truncator
+from .models import Post, Reply, VOTE_UP, VOTE_DOWN, VOTE_NONE
 from core.serializers import FileSerializer, UserSerializer
 from core.models import Tag
 
 
-class PostSerializer(serializers.ModelSerializer):
-    attachments = FileSerializer(many=True)
+class UserVoteListSerializer(serializers.ListSerializer):
+    """
+    Resolves votes of requesting user for every row of the page at once instead of querying per row.
+    """
+
+    def to_representation(self, data):
+        data = list(data.all() if isinstance(data, models.Manager) else data)
+        user = self.child.get_request_user()
+        if user and user.is_authenticated():
+            self.child.user_votes = self.child.Meta.model.get_user_votes(user, [obj.pk for obj in data])
+        else:
+            self.child.user_votes = {}
+        return super().to_representation(data)
+
+
+class UserVoteMixin(object):
+    """
+    Serializing with `shared` in context leaves out fields depending on requesting user so that the data can be cached
+    and shared between users. `merge_user_fields` fills them in later.
+    """
+    user_votes = None
+
+    def get_request_user(self):
+        if self.context.get('shared'):
+            return None
+        try:
+            return self.context['request'].user
+        except KeyError:
+            return None
+
+    @classmethod
+    def merge_user_fields(cls, data, objects, user):
+        user_votes = cls.Meta.model.get_user_votes(user, [obj.pk for obj in objects])
+        for item, obj in zip(data, objects):
+            item['user_vote'] = user_votes.get(obj.pk, VOTE_NONE)
+
+    def get_user_vote(self, obj):
+        if self.user_votes is not None:
+            return self.user_votes.get(obj.pk, VOTE_NONE)
+        user = self.get_request_user()
+        if not user or not user.is_authenticated():
+            return VOTE_NONE
+        return obj.get_user_vote(user)
+
+
+class ReplyPreviewSerializer(serializers.ModelSerializer):
+    """
+    Latest reply shown along a post, with content cut to `content_length` characters.
+    """
+    content_length = 140
+    username = serializers.CharField(source='user.username')
+    content = serializers.SerializerMethodField()
+
+    def get_content(self, obj):
+        return Truncator(obj.content).chars(self.content_length)
+
+    class Meta:
+        model = Reply
+        fields = ['id', 'user', 'username', 'content', 'created']
+
+
+class PostSerializer(UserVoteMixin, serializers.ModelSerializer):
+    attachments = FileSerializer(many=True, variant='medium')
     user = serializers.SerializerMethodField()
     tags = serializers.StringRelatedField(many=True, required=False)
-    upvotes = serializers.IntegerField(source='upvotes.count')
-    downvotes = serializers.IntegerField(source='downvotes.count')
+    upvotes = serializers.IntegerField(source='upvote_count', read_only=True)
+    downvotes = serializers.IntegerField(source='downvote_count', read_only=True)
     user_vote = serializers.SerializerMethodField()
+    last_reply = ReplyPreviewSerializer(read_only=True)
 
-    def get_user_vote(self, obj):
-        try:
-            user = self.context['request'].user
-        except KeyError:
-            return 0
-        if user in obj.upvotes.all():
-            return 1
-        if user in obj.downvotes.all():
-            return -1
-        return 0
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = queryset.select_related('last_reply__user').prefetch_related('tags', 'attachments')
+        return UserSerializer.setup_eager_loading(queryset, 'user__')
 
     def get_user(self, obj):
-        try:
-            user = self.context['request'].user
-        except KeyError:
-            user = None
+        user = self.get_request_user()
         if user == obj.user or not obj.anonymous:
             return UserSerializer(obj.user).data
         return None
 
+    @classmethod
+    def merge_user_fields(cls, data, objects, user):
+        super().merge_user_fields(data, objects, user)
+        for item, obj in zip(data, objects):
+            if item['anonymous'] and obj.user_id == user.id:
+                item['user'] = UserSerializer(user).data
+
     class Meta:
         model = Post
         fields = ['id', 'title', 'content', 'created', 'tags', 'anonymous', 'visibility', 'attachments',
-                  'upvotes', 'downvotes', 'user', 'user_vote']
+                  'upvotes', 'downvotes', 'user', 'user_vote', 'reply_count', 'last_reply']
+        read_only_fields = ['reply_count']
+        list_serializer_class = UserVoteListSerializer
 
 
 class NewPostSerializer(serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), required=False)
     attachments = FileSerializer(many=True, required=False)
 
+    def to_internal_value(self, data):
+        # Multipart requests send tags and attachments as repeated parts instead of lists
+        if html.is_html_input(data):
+            list_fields = ['tags', 'attachments']
+            multipart_data = {key: value for key, value in data.items() if key not in list_fields}
+            if 'tags' in data:
+                multipart_data['tags'] = data.getlist('tags')
+            if 'attachments' in data and 'attachments' in self.fields:
+                multipart_data['attachments'] = [{'file': file} for file in data.getlist('attachments')]
+            data = multipart_data
+        return super().to_internal_value(data)
+
     class Meta:
         model = Post
         fields = ['title', 'content', 'tags', 'anonymous', 'visibility', 'attachments']
@@ -55,29 +132,49 @@ class UpdatePostSerializer(NewPostSerializer):
         fields = ['title', 'content', 'tags', 'anonymous', 'visibility']
 
 
-class ReplySerializer(serializers.ModelSerializer):
-    upvotes = serializers.IntegerField(source='upvotes.count')
-    downvotes = serializers.IntegerField(source='downvotes.count')
+class ReplySerializer(UserVoteMixin, serializers.ModelSerializer):
+    upvotes = serializers.IntegerField(source='upvote_count', read_only=True)
+    downvotes = serializers.IntegerField(source='downvote_count', read_only=True)
     user = UserSerializer()
     user_vote = serializers.SerializerMethodField()
 
-    def get_user_vote(self, obj):
-        try:
-            user = self.context['request'].user
-        except KeyError:
-            return 0
-        if user in obj.upvotes.all():
-            return 1
-        if user in obj.downvotes.all():
-            return -1
-        return 0
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return UserSerializer.setup_eager_loading(queryset, 'user__')
 
     class Meta:
         model = Reply
+        exclude = ['upvote_count', 'downvote_count']
+        list_serializer_class = UserVoteListSerializer
 
 class NewReplySerializer(serializers.ModelSerializer):
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
 
     class Meta:
         model = Reply
-        fields = ['post', 'content', 'visibility']
\ No newline at end of file
+        fields = ['post', 'content', 'visibility']
+
+
+class VoteOperationSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=['post', 'reply'])
+    id = serializers.IntegerField()
+    vote = serializers.ChoiceField(choices=[VOTE_UP, VOTE_DOWN, VOTE_NONE])
+
+
+class VoteBatchSerializer(serializers.Serializer):
+    max_votes = 200
+    votes = VoteOperationSerializer(many=True)
+
+    def validate_votes(self, value):
+        if len(value) > self.max_votes:
+            raise serializers.ValidationError('At most %d votes are allowed per request' % self.max_votes)
+        return value
+
+
+class VoteResultSerializer(serializers.Serializer):
+    type = serializers.CharField()
+    id = serializers.IntegerField()
+    success = serializers.BooleanField()
+    user_vote = serializers.IntegerField(required=False)
+    upvotes = serializers.IntegerField(required=False)
+    downvotes = serializers.IntegerField(required=False)
@@ -0,0 +1,81 @@
+"""
+Delta sync of posts and replies. Changes are ordered by key (modified, type, id) and a cursor is the encoded key of
+the last change a client has seen, so ties of `modified` between rows updated together are kept apart.
+
+`modified` is taken from the clock before a write commits, so a write waiting on a lock can commit a value older than
+changes already returned. Changes newer than SYNC_CURSOR_LAG seconds are left for later requests so that cursors stay
+behind writes still committing.
+"""
+import base64
+import binascii
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post, Reply, CONTENT_VISIBLE, CONTENT_HIDDEN
+
+
+def encode_cursor(key):
+    modified, change_type, pk = key
+    return base64.urlsafe_b64encode(('%s %s %d' % (modified.isoformat(), change_type, pk)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Get key encoded in cursor, None for empty cursor. Raises ValueError for invalid cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        modified, change_type, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(' ')
+        modified = parse_datetime(modified)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if modified is None or change_type not in ['post', 'reply'] or not pk.isdigit():
+        raise ValueError('Invalid cursor')
+    return modified, change_type, int(pk)
+
+
+def after_q(cursor, change_type):
+    if cursor is None:
+        return Q()
+    modified, cursor_type, pk = cursor
+    q = Q(modified__gt=modified)
+    if change_type > cursor_type:
+        q |= Q(modified=modified)
+    elif change_type == cursor_type:
+        q |= Q(modified=modified, id__gt=pk)
+    return q
+
+
+def is_visible(user, visibility, user_id):
+    return visibility == CONTENT_VISIBLE or (visibility == CONTENT_HIDDEN and user_id == user.id)
+
+
+def get_changes(user, cursor, limit):
+    """
+    Get up to `limit` changes after `cursor` as list of (key, row, visible) and whether more changes are pending.
+    Rows have only `pk`, `user_id` and for replies `post_id` set. Rows not visible to user any more are changes too,
+    with `visible` false. Replies are visible only along with their post. Changes within SYNC_CURSOR_LAG seconds
+    are left out.
+    """
+    settled = timezone.now() - timedelta(seconds=settings.SYNC_CURSOR_LAG)
+    posts = Post.objects.filter(after_q(cursor, 'post'), modified__lte=settled).order_by('modified', 'id')
+    posts = posts.values_list('id', 'modified', 'user_id', 'visibility')[:limit + 1]
+    replies = Reply.objects.filter(after_q(cursor, 'reply'), modified__lte=settled).order_by('modified', 'id')
+    replies = replies.values_list('id', 'modified', 'user_id', 'visibility', 'post_id', 'post__visibility')
+    replies = replies[:limit + 1]
+
+    changes = [
+        ((modified, 'post', pk), Post(pk=pk, user_id=user_id), is_visible(user, visibility, user_id))
+        for pk, modified, user_id, visibility in posts
+    ] + [
+        ((modified, 'reply', pk), Reply(pk=pk, user_id=user_id, post_id=post_id),
+         is_visible(user, visibility, user_id) and post_visibility == CONTENT_VISIBLE)
+        for pk, modified, user_id, visibility, post_id, post_visibility in replies
+    ]
+    changes.sort(key=lambda change: change[0])
+    return changes[:limit], len(changes) > limit
@@ -1,3 +1,796 @@
-from django.test import TestCase
+import os
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from college.models import College
+from core.models import Tag
+from core.pagination import DefaultPaginationClass
+from core.tests import LocMemCacheTestCase, QueryBudgetTestCase, TemporaryMediaTestCase, PNG_BASE64, PNG_BYTES
+from .models import (Post, Reply, Vote, FeedEntry, HOT_DECAY_SECONDS, hot_score, VOTE_UP, VOTE_DOWN, VOTE_NONE,
+                     CONTENT_DELETED)
+from .search import is_available
+from .sync import encode_cursor
+from .views import PostViewset, ReplyViewset
+
+
+class PostQueryBudgetTest(QueryBudgetTestCase):
+
+    def test_list(self):
+        self.assertQueryBudget(8, lambda dataset: ('get', '/api/post/', None))
+
+    def test_retrieve(self):
+        self.assertQueryBudget(8, lambda dataset: ('get', '/api/post/%d/' % dataset['posts'][0].id, None))
+
+    def test_create(self):
+        def make_request(dataset):
+            data = {
+                'title': 'New post',
+                'content': 'Content',
+                'tags': [tag.id for tag in dataset['colleges'][0].tags.all()],
+                'attachments': [{'file': PNG_BASE64}, {'file': PNG_BASE64}],
+            }
+            return 'post', '/api/post/', data
+        self.assertQueryBudget(29, make_request)
+
+    def test_update(self):
+        def make_request(dataset):
+            data = {'title': 'Updated', 'tags': [tag.id for tag in dataset['colleges'][0].tags.all()]}
+            return 'put', '/api/post/%d/' % dataset['own_posts'][0].id, data
+        self.assertQueryBudget(24, make_request)
+
+    def test_partial_update(self):
+        def make_request(dataset):
+            return 'patch', '/api/post/%d/' % dataset['own_posts'][0].id, {'content': 'Updated'}
+        self.assertQueryBudget(12, make_request)
+
+    def test_destroy(self):
+        self.assertQueryBudget(9, lambda dataset: ('delete', '/api/post/%d/' % dataset['own_posts'][0].id, None))
+
+    def test_upvote(self):
+        self.assertQueryBudget(19, lambda dataset: ('post', '/api/post/%d/upvote/' % dataset['posts'][-1].id, None))
+
+    def test_downvote(self):
+        self.assertQueryBudget(19, lambda dataset: ('post', '/api/post/%d/downvote/' % dataset['posts'][-1].id, None))
+
+    def test_remove_vote(self):
+        self.assertQueryBudget(
+            11, lambda dataset: ('post', '/api/post/%d/remove_vote/' % dataset['posts'][-1].id, None))
+
+    def test_get_replies(self):
+        def make_request(dataset):
+            post = max(dataset['posts'], key=lambda post: post.replies.count())
+            return 'get', '/api/post/%d/get_replies/' % post.id, None
+        self.assertQueryBudget(7, make_request)
+
+    def test_filtered(self):
+        self.assertQueryBudget(10, lambda dataset: ('get', '/api/post/filtered/', None))
+
+    def test_current(self):
+        self.assertQueryBudget(8, lambda dataset: ('get', '/api/post/current/', None))
+
+    @override_settings(SYNC_CURSOR_LAG=0)
+    def test_changes(self):
+        def make_request(dataset):
+            cursor = encode_cursor((timezone.now(), 'reply', 0))
+            for row in dataset['posts'][:5] + dataset['replies'][:5]:
+                row.set_vote(self.user, 1)
+            return 'get', '/api/post/changes/', {'since': cursor}
+        self.assertQueryBudget(14, make_request)
+
+    def test_list_hot(self):
+        self.assertQueryBudget(8, lambda dataset: ('get', '/api/post/', {'order': 'hot'}))
+
+    def test_filtered_hot(self):
+        self.assertQueryBudget(10, lambda dataset: ('get', '/api/post/filtered/', {'order': 'hot'}))
+
+    def test_search(self):
+        self.assertQueryBudget(8, lambda dataset: ('get', '/api/post/search/', {'q': 'post content'}))
+
+    def test_vote_batch(self):
+        def make_request(dataset):
+            votes = [{'type': 'post', 'id': post.id, 'vote': 1} for post in dataset['posts'][:5]]
+            votes += [{'type': 'reply', 'id': reply.id, 'vote': -1} for reply in dataset['replies'][:5]]
+            return 'post', '/api/post/vote_batch/', {'votes': votes}
+        self.assertQueryBudget(19, make_request)
+
+
+class ReplyQueryBudgetTest(QueryBudgetTestCase):
+
+    def test_add(self):
+        def make_request(dataset):
+            return 'post', '/api/reply/add/', {'post': dataset['posts'][0].id, 'content': 'Reply'}
+        self.assertQueryBudget(13, make_request)
+
+    def test_delete(self):
+        self.assertQueryBudget(
+            11, lambda dataset: ('post', '/api/reply/%d/delete/' % dataset['own_replies'][0].id, None))
+
+    def test_upvote(self):
+        self.assertQueryBudget(14, lambda dataset: ('post', '/api/reply/%d/upvote/' % dataset['replies'][-1].id, None))
+
+    def test_downvote(self):
+        self.assertQueryBudget(
+            14, lambda dataset: ('post', '/api/reply/%d/downvote/' % dataset['replies'][-1].id, None))
+
+    def test_remove_vote(self):
+        self.assertQueryBudget(
+            9, lambda dataset: ('post', '/api/reply/%d/remove_vote/' % dataset['replies'][-1].id, None))
+
+
+class CollegeFeedTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag, self.other_tag = Tag.objects.create(tag='college'), Tag.objects.create(tag='other')
+        self.college = College.objects.create(name='College', location='Location')
+        self.college.tags.add(self.tag)
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.user.profile.college = self.college
+        self.user.profile.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, tags, **kwargs):
+        data = dict(title='Title', content='Content', tags=[tag.id for tag in tags], **kwargs)
+        return self.client.post('/api/post/', data, format='json').data['id']
+
+    def get_feed(self):
+        return [post['id'] for post in self.client.get('/api/post/filtered/').data['results']]
+
+    def test_feed_follows_tags_and_visibility(self):
+        tagged = self.create_post([self.tag])
+        untagged = self.create_post([self.other_tag])
+        hidden = self.create_post([self.tag], visibility='1')
+        self.assertEqual(self.get_feed(), [hidden, tagged])
+
+        self.client.put('/api/post/%d/' % untagged, {'tags': [self.tag.id]}, format='json')
+        self.client.delete('/api/post/%d/' % tagged)
+        self.assertEqual(self.get_feed(), [hidden, untagged])
+
+        self.college.tags.add(self.other_tag)
+        self.college.tags.remove(self.tag)
+        self.assertEqual(self.get_feed(), [])
+        self.assertFalse(FeedEntry.objects.exists())
+
+
+class OwnerAndUserTestCase(LocMemCacheTestCase):
+    """
+    Creates `owner` of posts and another `user`, with clients `owner_client` and `client` authenticated as them.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.owner_client, self.client = APIClient(), APIClient()
+        self.owner_client.force_authenticate(self.owner)
+        self.client.force_authenticate(self.user)
+
+
+class ResponseCacheTest(OwnerAndUserTestCase):
+
+    def setUp(self):
+        super().setUp()
+        data = {'title': 'Title', 'content': 'Content', 'anonymous': True}
+        self.post_id = self.owner_client.post('/api/post/', data, format='json').data['id']
+        self.url = '/api/post/%d/' % self.post_id
+
+    def test_cached_detail_is_invalidated_and_merged_per_user(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(2):
+            # Post row and vote of requesting user, serialized body comes from cache
+            data = self.client.get(self.url).data
+        self.assertIsNone(data['user'])
+        self.assertEqual(self.owner_client.get(self.url).data['user']['id'], self.owner.id)
+
+        self.client.post(self.url + 'upvote/')
+        self.assertEqual(self.client.get(self.url).data['upvotes'], 1)
+        self.assertEqual(self.client.get(self.url).data['user_vote'], 1)
+        self.assertEqual(self.owner_client.get(self.url).data['user_vote'], 0)
+
+        self.owner_client.patch(self.url, {'title': 'Updated'}, format='json')
+        self.assertEqual(self.client.get(self.url).data['title'], 'Updated')
+
+    def test_cached_replies_are_invalidated(self):
+        replies_url = self.url + 'get_replies/'
+        self.assertEqual(self.client.get(replies_url).data['results'], [])
+        reply = self.client.post('/api/reply/add/', {'post': self.post_id, 'content': 'Reply'}, format='json')
+        self.assertEqual([reply['id'] for reply in self.client.get(replies_url).data['results']],
+                         [reply.data['id']])
+        self.owner_client.post('/api/reply/%d/downvote/' % reply.data['id'])
+        self.assertEqual(self.client.get(replies_url).data['results'][0]['downvotes'], 1)
+
+    def test_cached_author_follows_profile_and_college(self):
+        college = College.objects.create(name='College', location='Location')
+        self.owner.profile.college = college
+        self.owner.profile.save()
+        self.assertEqual(self.owner_client.get(self.url).data['user']['college']['name'], 'College')
+
+        college.name = 'Renamed'
+        college.save()
+        self.assertEqual(self.owner_client.get(self.url).data['user']['college']['name'], 'Renamed')
+        self.owner.first_name = 'Owner'
+        self.owner.save()
+        self.assertEqual(self.owner_client.get(self.url).data['user']['first_name'], 'Owner')
+
+    def test_cached_post_follows_tags_and_reply_author(self):
+        tag = Tag.objects.create(tag='tag')
+        self.owner_client.patch(self.url, {'tags': [tag.id]}, format='json')
+        self.client.post('/api/reply/add/', {'post': self.post_id, 'content': 'Reply'}, format='json')
+        data = self.owner_client.get(self.url).data
+        self.assertEqual((data['tags'], data['last_reply']['username']), (['tag'], 'tester'))
+
+        tag.tag = 'renamed'
+        tag.save()
+        self.user.username = 'renamed'
+        self.user.save()
+        data = self.owner_client.get(self.url).data
+        self.assertEqual((data['tags'], data['last_reply']['username']), (['renamed'], 'renamed'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite only')
+class VisibilityQueryPlanTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+
+    def get_plan(self, queryset):
+        sql, params = queryset[:20].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset, index):
+        plan = self.get_plan(queryset)
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_live_content_indexes_are_used(self):
+        posts = Post.objects.visible_to(self.user).order_by('-created')
+        self.assertUsesIndex(posts, 'post_post_live_created')
+        self.assertUsesIndex(posts.filter(user=self.user), 'post_post_live_user_created')
+        self.assertUsesIndex(Post.objects.visible_to(self.user).order_by('-hot'), 'post_post_live_hot')
+        replies = Reply.objects.visible_to(self.user).filter(post_id=1).order_by('-created')
+        self.assertUsesIndex(replies, 'post_reply_live_post_created')
+
+
+class LiveContentLookupTest(LocMemCacheTestCase):
+
+    def test_only_true_is_accepted(self):
+        user = User.objects.create_user(username='tester', password='password')
+        live = Post.objects.create(user=user, title='Title', content='Content')
+        Post.objects.create(user=user, title='Title', content='Content', visibility=CONTENT_DELETED)
+        self.assertEqual(list(Post.objects.filter(visibility__live=True)), [live])
+        for value in [False, None, 'True']:
+            with self.assertRaises(ValueError):
+                Post.objects.filter(visibility__live=value)
+
+
+class ReplySummaryTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.post_id = self.client.post('/api/post/', {'title': 'Title', 'content': 'Content'}, format='json').data['id']
+
+    def add_reply(self, content, **kwargs):
+        data = dict(post=self.post_id, content=content, **kwargs)
+        return self.client.post('/api/reply/add/', data, format='json').data['id']
+
+    def get_summary(self):
+        data = self.client.get('/api/post/').data['results'][0]
+        return data['reply_count'], data['last_reply'] and data['last_reply']['id']
+
+    def test_summary_follows_visible_replies(self):
+        self.assertEqual(self.get_summary(), (0, None))
+        first = self.add_reply('First')
+        second = self.add_reply('Second ' * 50)
+        self.add_reply('Hidden', visibility='1')
+        self.assertEqual(self.get_summary(), (2, second))
+        preview = self.client.get('/api/post/%d/' % self.post_id).data['last_reply']
+        self.assertEqual(preview['username'], 'tester')
+        self.assertLessEqual(len(preview['content']), 140)
+
+        self.client.post('/api/reply/%d/delete/' % second)
+        self.assertEqual(self.get_summary(), (1, first))
+        self.client.post('/api/reply/%d/delete/' % first)
+        self.assertEqual(self.get_summary(), (0, None))
+
+
+class VoteCountTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(username='user%d' % index, password='password') for index in range(3)]
+        self.post = Post.objects.create(user=self.users[0], title='Title', content='Content')
+        self.reply = Reply.objects.create(user=self.users[0], post=self.post, content='Reply')
+        self.clients = []
+        for user in self.users:
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def assertCounts(self, obj, counts):
+        obj.refresh_from_db()
+        self.assertEqual((obj.upvote_count, obj.downvote_count), counts)
+
+    def test_votes_keep_counters_in_sync(self):
+        for url, obj in [('/api/post/%d/' % self.post.id, self.post), ('/api/reply/%d/' % self.reply.id, self.reply)]:
+            self.clients[0].post(url + 'upvote/')
+            self.clients[1].post(url + 'upvote/')
+            self.clients[2].post(url + 'downvote/')
+            self.assertCounts(obj, (2, 1))
+            # Repeated votes change nothing, switching moves the vote
+            self.clients[0].post(url + 'upvote/')
+            self.clients[1].post(url + 'downvote/')
+            self.assertCounts(obj, (1, 2))
+            self.clients[2].post(url + 'remove_vote/')
+            self.clients[2].post(url + 'remove_vote/')
+            self.assertCounts(obj, (1, 1))
+
+    def test_rebuild_repairs_drifted_counters(self):
+        self.post.set_vote(self.users[1], VOTE_UP)
+        self.reply.set_vote(self.users[1], VOTE_DOWN)
+        Post.objects.filter(pk=self.post.pk).update(upvote_count=5, downvote_count=2)
+        Reply.objects.filter(pk=self.reply.pk).update(upvote_count=1)
+
+        call_command('rebuild_vote_counts', '--dry-run', stdout=open(os.devnull, 'w'))
+        self.assertCounts(self.post, (5, 2))
+        call_command('rebuild_vote_counts', stdout=open(os.devnull, 'w'))
+        self.assertCounts(self.post, (1, 0))
+        self.assertCounts(self.reply, (0, 1))
+        self.assertEqual(self.post.hot, hot_score(1, 0, 0, self.post.created))
+
+
+@patch.object(DefaultPaginationClass, 'page_size', 2)
+class CursorPaginationTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(user=self.user, title='Title', content='Content')
+
+    def get_pages(self, url):
+        """
+        Follow next links from `url` then previous links back, returns ids of pages in both directions
+        """
+        forward, backward = [], []
+        data = self.client.get(url).data
+        forward.append([row['id'] for row in data['results']])
+        while data['next']:
+            data = self.client.get(data['next']).data
+            forward.append([row['id'] for row in data['results']])
+        while data['previous']:
+            data = self.client.get(data['previous']).data
+            backward.append([row['id'] for row in data['results']])
+        return forward, backward
+
+    def assertPages(self, url, ids):
+        forward, backward = self.get_pages(url)
+        self.assertEqual([len(page) for page in forward], [2, 2, 2])
+        self.assertEqual(sorted(sum(forward, [])), sorted(ids))
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_posts_with_tied_created(self):
+        posts = [self.post.id] + [Post.objects.create(user=self.user, title='Title', content='Content').id
+                                  for _ in range(5)]
+        Post.objects.update(created=self.post.created)
+        self.assertPages('/api/post/', posts)
+
+    def test_replies(self):
+        replies = [Reply.objects.create(user=self.user, post=self.post, content='Reply').id for _ in range(6)]
+        Reply.objects.filter(pk__in=replies[:3]).update(created=timezone.now() - timedelta(hours=1))
+        self.assertPages('/api/post/%d/get_replies/' % self.post.id, replies)
+
+
+class UserVoteTest(LocMemCacheTestCase):
+
+    def test_page_votes_resolved_at_once(self):
+        owner, user = [User.objects.create_user(username=name, password='password') for name in ['owner', 'tester']]
+        posts = [Post.objects.create(user=owner, title='Title', content='Content') for _ in range(6)]
+        votes = [VOTE_UP, VOTE_DOWN, VOTE_NONE] * 2
+        for post, value in zip(posts, votes):
+            post.set_vote(user, value)
+            post.set_vote(owner, VOTE_UP)
+        client = APIClient()
+        client.force_authenticate(user)
+        expected = {post.id: value for post, value in zip(posts, votes)}
+
+        cache.clear()
+        # Page, posts with related rows prefetched and votes of all posts, not a query per post
+        with self.assertNumQueries(6):
+            data = client.get('/api/post/').data['results']
+        self.assertEqual({post['id']: post['user_vote'] for post in data}, expected)
+        # Page, then votes of all its posts in one query, serialized bodies come from cache
+        with self.assertNumQueries(2):
+            data = client.get('/api/post/').data['results']
+        self.assertEqual({post['id']: post['user_vote'] for post in data}, expected)
+
+
+class StaleSaveTest(LocMemCacheTestCase):
+    """
+    Votes and replies landing between a view loading a row and saving it must survive the save
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(user=self.user, title='Title', content='Content')
+        self.reply = Reply.objects.create(user=self.user, post=self.post, content='Reply')
+        Post.reply_changed(self.reply, was_visible=False)
+
+    def vote_after_load(self, viewset, model, pk, value):
+        get_object = viewset.get_object
+
+        def get_object_then_vote(view):
+            obj = get_object(view)
+            model.objects.get(pk=pk).set_vote(self.other, value)
+            return obj
+        return patch.object(viewset, 'get_object', get_object_then_vote)
+
+    def test_post_edits_keep_feed_scores(self):
+        tag = Tag.objects.create(tag='tag')
+        College.objects.create(name='College', location='Location').tags.add(tag)
+        self.client.put('/api/post/%d/' % self.post.pk, {'tags': [tag.id]}, format='json')
+        with self.vote_after_load(PostViewset, Post, self.post.pk, VOTE_UP):
+            response = self.client.put('/api/post/%d/' % self.post.pk, {'tags': [tag.id]}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(FeedEntry.objects.get(post=self.post).hot, Post.objects.get(pk=self.post.pk).hot)
+
+    def test_post_edits_keep_counters(self):
+        with self.vote_after_load(PostViewset, Post, self.post.pk, VOTE_UP):
+            self.assertEqual(self.client.put('/api/post/%d/' % self.post.pk, {'title': 'Edited'}).status_code, 200)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.title, post.upvote_count, post.reply_count, post.last_reply_id),
+                         ('Edited', 1, 1, self.reply.pk))
+        self.assertEqual(post.hot, hot_score(1, 0, 1, post.created))
+
+        with self.vote_after_load(PostViewset, Post, self.post.pk, VOTE_DOWN):
+            self.assertEqual(self.client.delete('/api/post/%d/' % self.post.pk).status_code, 200)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.visibility, post.upvote_count, post.downvote_count), (CONTENT_DELETED, 0, 1))
+
+    def test_reply_delete_keeps_counters(self):
+        with self.vote_after_load(ReplyViewset, Reply, self.reply.pk, VOTE_UP):
+            self.assertEqual(self.client.post('/api/reply/%d/delete/' % self.reply.pk).status_code, 200)
+        reply = Reply.objects.get(pk=self.reply.pk)
+        self.assertEqual((reply.visibility, reply.upvote_count), (CONTENT_DELETED, 1))
+
+
+class VoteBatchTest(OwnerAndUserTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(user=self.owner, title='Title', content='Content')
+        self.hidden = Post.objects.create(user=self.owner, title='Title', content='Content', visibility='1')
+        self.reply = Reply.objects.create(user=self.owner, post=self.post, content='Reply')
+
+    def vote_batch(self, votes):
+        return self.client.post('/api/post/vote_batch/', {'votes': votes}, format='json')
+
+    def test_votes_are_applied_and_reported_per_item(self):
+        self.post.set_vote(self.user, -1)
+        response = self.vote_batch([
+            {'type': 'post', 'id': self.post.id, 'vote': 0},
+            {'type': 'post', 'id': self.post.id, 'vote': 1},
+            {'type': 'reply', 'id': self.reply.id, 'vote': -1},
+            {'type': 'post', 'id': self.hidden.id, 'vote': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['success'], item.get('user_vote')) for item in response.data],
+                         [(True, 1), (True, 1), (True, -1), (False, None)])
+        self.assertEqual((response.data[1]['upvotes'], response.data[1]['downvotes']), (1, 0))
+
+        self.post.refresh_from_db()
+        self.reply.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count), (1, 0))
+        self.assertEqual((self.reply.upvote_count, self.reply.downvote_count), (0, 1))
+        self.assertEqual(self.post.get_user_vote(self.user), 1)
+        self.assertEqual(self.client.get('/api/post/%d/' % self.post.id).data['user_vote'], 1)
+
+        self.vote_batch([{'type': 'reply', 'id': self.reply.id, 'vote': 0}])
+        self.reply.refresh_from_db()
+        self.assertEqual((self.reply.upvote_count, self.reply.downvote_count), (0, 0))
+
+    def test_votes_are_written_in_batches(self):
+        posts = [self.post] + [Post.objects.create(user=self.owner, title='Title', content='Content') for _ in range(2)]
+        with patch('post.models.VOTE_BATCH_SIZE', 2):
+            response = self.vote_batch([{'type': 'post', 'id': post.id, 'vote': -1} for post in posts])
+        self.assertTrue(all(item['success'] for item in response.data))
+        self.assertEqual(list(Post.objects.filter(pk__in=[post.id for post in posts]).values_list(
+            'downvote_count', flat=True)), [1, 1, 1])
+
+    def test_invalid_vote_is_rejected(self):
+        self.assertEqual(self.vote_batch([{'type': 'post', 'id': self.post.id, 'vote': 2}]).status_code, 400)
+
+    def concurrent_vote_before_insert(self, value):
+        """
+        Patch Vote.objects.bulk_create so that another request of same user votes `value` after votes were read
+        """
+        original = Vote.objects.bulk_create
+        raced = []
+
+        def vote_first(*args, **kwargs):
+            if not raced:
+                raced.append(True)
+                Post.objects.get(pk=self.post.pk).set_vote(self.user, value)
+            return original(*args, **kwargs)
+        return patch.object(Vote.objects, 'bulk_create', vote_first)
+
+    def test_concurrent_vote_of_same_user(self):
+        with self.concurrent_vote_before_insert(VOTE_DOWN):
+            self.post.set_vote(self.user, VOTE_UP)
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count), (1, 0))
+        self.assertEqual(self.post.get_user_vote(self.user), VOTE_UP)
+
+    def test_concurrent_vote_in_batch(self):
+        with self.concurrent_vote_before_insert(VOTE_UP):
+            self.assertEqual(self.vote_batch([{'type': 'post', 'id': self.post.id, 'vote': 1}]).status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count), (1, 0))
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 1)
+
+
+@override_settings(SYNC_CURSOR_LAG=0)
+class ChangesTest(OwnerAndUserTestCase):
+
+    def create_post(self, **kwargs):
+        data = dict(title='Title', content='Content', **kwargs)
+        return self.owner_client.post('/api/post/', data, format='json').data['id']
+
+    def get_changes(self, since=None):
+        return self.client.get('/api/post/changes/', {'since': since} if since else None).data
+
+    def test_changes_since_cursor(self):
+        first, second = self.create_post(), self.create_post()
+        data = self.get_changes()
+        self.assertEqual([post['id'] for post in data['posts']], [first, second])
+        self.assertFalse(data['has_more'])
+        cursor = data['next']
+        self.assertEqual(self.get_changes(cursor)['posts'], [])
+
+        self.client.post('/api/post/%d/upvote/' % first)
+        reply = self.client.post('/api/reply/add/', {'post': second, 'content': 'Reply'}, format='json').data['id']
+        self.owner_client.delete('/api/post/%d/' % first)
+        hidden = self.create_post(visibility='1')
+        data = self.get_changes(cursor)
+        self.assertEqual([post['id'] for post in data['posts']], [second])
+        self.assertEqual(data['posts'][0]['reply_count'], 1)
+        self.assertEqual([reply['id'] for reply in data['replies']], [reply])
+        self.assertEqual(data['deleted'], [{'type': 'post', 'id': first}, {'type': 'post', 'id': hidden}])
+        self.assertEqual(self.get_changes(data['next'])['deleted'], [])
+
+    def test_changes_are_paginated(self):
+        posts = [self.create_post() for _ in range(5)]
+        Post.objects.update(modified=Post.objects.get(pk=posts[0]).modified)
+        ids, cursor = [], None
+        with patch.object(PostViewset, 'changes_page_size', 2):
+            while True:
+                data = self.get_changes(cursor)
+                ids += [post['id'] for post in data['posts']]
+                cursor = data['next']
+                if not data['has_more']:
+                    break
+        self.assertEqual(ids, posts)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/post/changes/', {'since': 'invalid'}).status_code, 400)
+
+    @override_settings(SYNC_CURSOR_LAG=60)
+    def test_recent_changes_wait_for_lag(self):
+        old, recent = self.create_post(), self.create_post()
+        Post.objects.filter(pk=old).update(modified=timezone.now() - timedelta(minutes=2))
+        data = self.get_changes()
+        self.assertEqual([post['id'] for post in data['posts']], [old])
+        # A write committing late with a timestamp older than recent changes isn't skipped by the cursor
+        late = self.create_post()
+        Post.objects.filter(pk=late).update(modified=timezone.now() - timedelta(seconds=90))
+        Post.objects.filter(pk=recent).update(modified=timezone.now() - timedelta(seconds=61))
+        self.assertEqual([post['id'] for post in self.get_changes(data['next'])['posts']], [late, recent])
+
+
+class ConditionalResponseTest(OwnerAndUserTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.post_id = self.owner_client.post('/api/post/', {'title': 'Title', 'content': 'Content'},
+                                              format='json').data['id']
+
+    def assertNotModified(self, url, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_etags_follow_versions(self):
+        url = '/api/post/%d/' % self.post_id
+        replies_url = url + 'get_replies/'
+        etags = [self.assertNotModified(path) for path in [url, '/api/post/', replies_url]]
+        self.assertNotEqual(self.assertNotModified(url, self.owner_client), etags[0])
+
+        self.owner_client.post(url + 'upvote/')
+        self.client.post('/api/reply/add/', {'post': self.post_id, 'content': 'Reply'}, format='json')
+        for path, etag in zip([url, '/api/post/', replies_url], etags):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_skips_serialization(self):
+        url = '/api/post/%d/' % self.post_id
+        etag = self.client.get(url)['ETag']
+        with patch('post.views.get_posts_data') as get_posts_data:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertFalse(get_posts_data.called)
+
+
+class SearchTest(OwnerAndUserTestCase):
+    def create_post(self, title, content, **kwargs):
+        data = dict(title=title, content=content, **kwargs)
+        return self.owner_client.post('/api/post/', data, format='json').data['id']
+
+    def search(self, query, client=None, **params):
+        data = (client or self.client).get('/api/post/search/', dict(q=query, **params)).data
+        return [post['id'] for post in data['results']], data['next']
+
+    @skipUnless(is_available(), 'Search index is available on SQLite with FTS5 only')
+    def test_search_ranks_and_follows_changes(self):
+        in_content = self.create_post('Exams', 'Library hours during exams')
+        in_title = self.create_post('Library timings', 'When is it open?')
+        hidden = self.create_post('Library', 'Hidden', visibility='1')
+        self.assertEqual(self.search('library'), ([in_title, in_content], None))
+        self.assertEqual(self.search('library', self.owner_client)[0], [hidden, in_title, in_content])
+        self.assertEqual(self.search('"library*'), ([in_title, in_content], None))
+        self.assertEqual(self.search(''), ([], None))
+
+        self.owner_client.patch('/api/post/%d/' % in_content, {'content': 'Canteen menu'}, format='json')
+        self.owner_client.delete('/api/post/%d/' % in_title)
+        self.assertEqual(self.search('library'), ([], None))
+        self.assertEqual(self.search('canteen'), ([in_content], None))
+
+    @skipUnless(is_available(), 'Search index is available on SQLite with FTS5 only')
+    def test_search_is_paginated(self):
+        posts = [self.create_post('Notice', 'Notice %d' % index) for index in range(3)]
+        with patch.object(PostViewset, 'search_page_size', 2):
+            first, next_link = self.search('notice')
+            second = self.client.get(next_link).data
+        self.assertEqual(sorted(first + [post['id'] for post in second['results']]), posts)
+        self.assertIsNone(second['next'])
+        self.assertIsNotNone(second['previous'])
+
+    def test_search_without_index(self):
+        in_content = self.create_post('Exams', 'Library hours during exams')
+        in_title = self.create_post('Library timings', 'When is it open?')
+        hidden = self.create_post('Library', 'Hidden', visibility='1')
+        with patch('post.search._fts5', False):
+            self.assertEqual(self.search('library'), ([in_title, in_content], None))
+            self.assertEqual(self.search('library', self.owner_client)[0], [hidden, in_title, in_content])
+            self.assertEqual(self.search('exams library'), ([in_content], None))
+            self.assertEqual(self.search('"library*'), ([in_title, in_content], None))
+
+
+class HotRankingTest(LocMemCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(tag='college')
+        college = College.objects.create(name='College', location='Location')
+        college.tags.add(self.tag)
+        self.users = [User.objects.create_user(username='user%d' % index, password='password') for index in range(3)]
+        self.users[0].profile.college = college
+        self.users[0].profile.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_ids(self, url, **params):
+        return [post['id'] for post in self.client.get(url, params).data['results']]
+
+    def test_engagement_lifts_older_posts(self):
+        data = {'title': 'Title', 'content': 'Content', 'tags': [self.tag.id]}
+        old, new = [self.client.post('/api/post/', data, format='json').data['id'] for _ in range(2)]
+        for url in ['/api/post/', '/api/post/filtered/']:
+            self.assertEqual(self.get_ids(url, order='hot'), [new, old])
+
+        for user in self.users[1:]:
+            client = APIClient()
+            client.force_authenticate(user)
+            client.post('/api/post/%d/upvote/' % old)
+            client.post('/api/reply/add/', {'post': old, 'content': 'Reply'}, format='json')
+        for url in ['/api/post/', '/api/post/filtered/']:
+            self.assertEqual(self.get_ids(url, order='hot'), [old, new])
+            self.assertEqual(self.get_ids(url), [new, old])
+
+        post = Post.objects.get(pk=old)
+        self.assertEqual(post.hot, hot_score(2, 0, 2, post.created))
+        self.assertEqual(FeedEntry.objects.get(post=old).hot, post.hot)
+
+    def test_hot_order_ignored_by_replies(self):
+        post = self.client.post('/api/post/', {'title': 'Title', 'content': 'Content'}, format='json').data['id']
+        replies = [self.client.post('/api/reply/add/', {'post': post, 'content': 'Reply'}, format='json').data['id']
+                   for _ in range(2)]
+        response = self.client.get('/api/post/%d/get_replies/' % post, {'order': 'hot'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(reply['id'] for reply in response.data['results']), replies)
+
+    def test_rebuild_in_batches(self):
+        posts = [Post.objects.create(user=self.users[0], title='Title', content='Content', upvote_count=index)
+                 for index in range(3)]
+        Post.objects.update(hot=0)
+        with patch('post.models.HOT_UPDATE_BATCH_SIZE', 2):
+            call_command('rebuild_hot_scores', stdout=open(os.devnull, 'w'))
+        for post in posts:
+            post.refresh_from_db()
+            self.assertEqual(post.hot, hot_score(post.upvote_count, 0, 0, post.created))
+
+    def test_hot_score(self):
+        created = timezone.now()
+        self.assertGreater(hot_score(10, 0, 0, created), hot_score(1, 0, 0, created))
+        self.assertGreater(hot_score(0, 0, 0, created), hot_score(0, 10, 0, created))
+        self.assertAlmostEqual(hot_score(10, 0, 0, created) - hot_score(1, 0, 0, created),
+                               hot_score(0, 0, 0, created + timedelta(seconds=HOT_DECAY_SECONDS)) -
+                               hot_score(0, 0, 0, created), places=5)
+
+
+class MultipartUploadTest(TemporaryMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(tag='tag')
+
+    def test_create_with_file_parts(self):
+        files = [SimpleUploadedFile('image%d.png' % index, PNG_BYTES) for index in range(2)]
+        data = {'title': 'Title', 'content': 'Content', 'tags': [self.tag.id], 'anonymous': 'true',
+                'attachments': files}
+        response = self.client.post('/api/post/', data, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertTrue(post.anonymous)
+        self.assertEqual(list(post.tags.all()), [self.tag])
+        self.assertEqual([file.mime_type for file in post.attachments.all()], ['image/png', 'image/png'])
+        for file in post.attachments.all():
+            with open(file.file.path, 'rb') as stored:
+                self.assertEqual(stored.read(), PNG_BYTES)
+
+    def test_json_base64_still_supported(self):
+        data = {'title': 'Title', 'content': 'Content', 'attachments': [{'file': PNG_BASE64}]}
+        response = self.client.post('/api/post/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['attachments'][0]['mime_type'], 'image/png')
+
+    @override_settings(DEFERRED_BLOB_MOVES=False)
+    def test_destroy_deletes_attachments_in_bulk(self):
+        counts = []
+        for attachments in [1, 5]:
+            files = [SimpleUploadedFile('image.png', PNG_BYTES + bytes([index])) for index in range(attachments)]
+            data = {'title': 'Title', 'content': 'Content', 'attachments': files}
+            post = Post.objects.get(pk=self.client.post('/api/post/', data, format='multipart').data['id'])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.delete('/api/post/%d/' % post.id).status_code, 200)
+            counts.append(len(queries))
+            for file in post.attachments.all():
+                self.assertTrue(file.file.name.startswith('deleted/'))
+                self.assertTrue(os.path.exists(file.file.path))
+        self.assertEqual(counts[0], counts[1])
@@ -1,30 +1,93 @@
+from collections import OrderedDict
+
 from rest_framework import viewsets
-from .serializers import PostSerializer, NewPostSerializer, UpdatePostSerializer, ReplySerializer, NewReplySerializer
-from .models import Post, Reply, CONTENT_VISIBLE, CONTENT_DELETED, CONTENT_HIDDEN
+from .serializers import (PostSerializer, NewPostSerializer, UpdatePostSerializer, ReplySerializer, NewReplySerializer,
+                          VoteBatchSerializer)
+from .models import (Post, Reply, FeedEntry, CONTENT_VISIBLE, CONTENT_DELETED, CONTENT_HIDDEN, VOTE_UP, VOTE_DOWN,
+                     VOTE_NONE, visible_to_q)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
-from core.models import File
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from core.models import File, Tag
+from django.db import transaction
 from django.http import Http404
-from core.views import SerializerClassRequestContextMixin
+from core.cache import get_versions, bump_versions, tag_version_key
+from core.views import SerializerClassRequestContextMixin, ConditionalResponseMixin
+from core.pagination import DefaultPaginationClass
+from .cache import (get_posts_data, get_replies_data, get_posts_versions, get_replies_versions, get_cached_page,
+                    get_paginated_data, bump_post_versions, bump_replies_version, post_version_key, replies_version_key,
+                    hot_version_key)
+from .search import index_post, search_posts
+from .sync import get_changes, encode_cursor, decode_cursor
 
 
-class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
+class PostViewset(ConditionalResponseMixin, SerializerClassRequestContextMixin, viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DefaultPaginationClass
+    cursor_orderings = {'hot': '-hot'}
+    changes_page_size = 100
+    search_page_size = 20
+
+    def get_data_response(self, objects, get_versions, get_data, links=None):
+        """
+        Conditional response with cached data of `objects`, one of get_posts/replies_versions and _data are passed.
+        Responds with a page if next and previous `links` are given, with data of the only object otherwise.
+        """
+        versions = get_versions(objects)
+        etag = self.get_etag([obj.pk for obj in objects], sorted(versions.items()), links)
+
+        def build_data():
+            data = get_data(objects, self.request, versions)
+            return get_paginated_data(data, *links) if links is not None else data[0]
+        return self.get_conditional_response(etag, build_data)
+
+    def get_paginated_posts_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        links = (self.paginator.get_next_link(), self.paginator.get_previous_link())
+        return self.get_data_response(page, get_posts_versions, get_posts_data, links)
+
+    def get_cached_page(self, key, versions, queryset, get_post=None):
+        """
+        Paginate queryset through cache, returns (list of (pk, user_id), next link, previous link).
+        `get_post` maps paginated rows to posts if queryset isn't of posts.
+        """
+        def build_page():
+            page = self.paginate_queryset(queryset)
+            if get_post:
+                page = [get_post(row) for row in page]
+            return page, self.paginator.get_next_link(), self.paginator.get_previous_link()
+        return get_cached_page(key, self.request.query_params.dict(), versions, build_page)
 
     def get_queryset(self):
-        user = self.request.user
-        base_queryset = Post.objects.all()
-        queryset = base_queryset.filter(visibility=CONTENT_VISIBLE)
-        queryset |= base_queryset.filter(visibility=CONTENT_HIDDEN, user=user)
-        queryset = queryset.order_by('-created')
-        return queryset
+        return Post.objects.visible_to(self.request.user).order_by('-created')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Get all posts visible to user, newest first or hottest first with `order=hot`
+        ---
+        serializer: post.serializers.PostSerializer
+        parameters:
+          - name: order
+            type: string
+            paramType: query
+        """
+        return self.get_paginated_posts_response(self.get_queryset())
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Get post by id
+        ---
+        serializer: post.serializers.PostSerializer
+        """
+        return self.get_data_response([self.get_object()], get_posts_versions, get_posts_data)
 
     def create(self, request, *args, **kwargs):
         """
-        Create new Post
+        Create new Post. Attachments are sent either as list of base64 files in JSON or as `attachments` file parts of
+        a multipart request, repeated for every file.
         ---
         response_serializer: post.serializers.PostSerializer
         parameters:
@@ -59,8 +122,11 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
             tags = serialized_data.validated_data.get('tags', [])
             post.tags.add(*tags)
             post.attachments.add(*files)
+            FeedEntry.update_post(post)
+            index_post(post)
+            bump_post_versions(post, [tag.id for tag in tags])
 
-            return Response(self.get_context_serializer_class(PostSerializer, post).data)
+            return Response(get_posts_data([post], request)[0])
         else:
             return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
 
@@ -95,10 +161,17 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
             except KeyError:
                 pass
 
+            feed_changed = False
+            tag_ids = []
+            if 'tags' in serialized_data.validated_data or 'visibility' in serialized_data.validated_data:
+                # Feeds of old tags change too
+                tag_ids = list(post.tags.values_list('id', flat=True))
             try:
                 tags = serialized_data.validated_data['tags']
                 post.tags.clear()
                 post.tags.add(*tags)
+                tag_ids += [tag.id for tag in tags]
+                feed_changed = True
             except KeyError:
                 pass
 
@@ -109,11 +182,17 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
 
             try:
                 post.visibility = serialized_data.validated_data['visibility']
+                feed_changed = True
             except KeyError:
                 pass
 
-            post.save()
-            return Response(self.get_context_serializer_class(PostSerializer, post).data)
+            # Counters are maintained with F() updates, so only edited fields are written
+            post.save(update_fields=['title', 'content', 'anonymous', 'visibility', 'modified'])
+            if feed_changed:
+                FeedEntry.update_post(post)
+            index_post(post)
+            bump_post_versions(post, tag_ids)
+            return Response(get_posts_data([post], request)[0])
         else:
             return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
 
@@ -127,11 +206,13 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
         if post.user.id != request.user.id:
             return Response({'success': False, 'message': 'Unauthorized Access'}, status=HTTP_403_FORBIDDEN)
 
-        for attachment in post.attachments.all():
-            attachment.delete()
+        post.attachments.all().delete()
 
         post.visibility = CONTENT_DELETED
-        post.save()
+        post.save(update_fields=['visibility', 'modified'])
+        FeedEntry.update_post(post)
+        index_post(post)
+        bump_post_versions(post, post.tags.values_list('id', flat=True))
         return Response({'success': True, 'message': 'Post deleted'})
 
     def partial_update(self, request, *args, **kwargs):
@@ -159,9 +240,9 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
 
         """
         post = self.get_object()
-        post.downvotes.remove(request.user)
-        post.upvotes.add(request.user)
-        return Response(self.get_context_serializer_class(PostSerializer, post).data)
+        post.set_vote(request.user, VOTE_UP)
+        bump_post_versions(post)
+        return Response(get_posts_data([post], request)[0])
 
     @detail_route(methods=['POST'])
     def downvote(self, request, pk):
@@ -172,9 +253,9 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
             form: replace
         """
         post = self.get_object()
-        post.upvotes.remove(request.user)
-        post.downvotes.add(request.user)
-        return Response(self.get_context_serializer_class(PostSerializer, post).data)
+        post.set_vote(request.user, VOTE_DOWN)
+        bump_post_versions(post)
+        return Response(get_posts_data([post], request)[0])
 
     @detail_route(methods=['POST'])
     def remove_vote(self, request, pk):
@@ -185,9 +266,9 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
             form: replace
         """
         post = self.get_object()
-        post.upvotes.remove(request.user)
-        post.downvotes.remove(request.user)
-        return Response(self.get_context_serializer_class(PostSerializer, post).data)
+        post.set_vote(request.user, VOTE_NONE)
+        bump_post_versions(post)
+        return Response(get_posts_data([post], request)[0])
 
     @detail_route()
     def get_replies(self, request, pk):
@@ -199,23 +280,37 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
         post = self.get_object()
         if post.visibility in [CONTENT_HIDDEN, CONTENT_DELETED]:
             raise Http404
-        replies = Reply.objects.all().filter(visibility=CONTENT_VISIBLE, post=post)
-        replies |= Reply.objects.all().filter(visibility=CONTENT_HIDDEN, post=post, user=request.user)
-        replies = replies.order_by('-created')
-        return Response(self.get_context_serializer_class(ReplySerializer, replies, many=True).data)
+        replies = Reply.objects.visible_to(request.user).filter(post=post)
+        versions = get_versions([replies_version_key(post.id)])
+        page, next_link, previous_link = self.get_cached_page(
+            'post:replies:%d:%d' % (post.id, request.user.id), versions, replies)
+        replies = [Reply(pk=pk, user_id=user_id, post_id=post.id) for pk, user_id in page]
+        return self.get_data_response(replies, get_replies_versions, get_replies_data, (next_link, previous_link))
 
     @list_route()
     def filtered(self, request):
         """
-        Get posts related to user's college tags
+        Get posts related to user's college tags, newest first or hottest first with `order=hot`
+        ---
+        parameters:
+          - name: order
+            type: string
+            paramType: query
         """
-        college = request.user.profile.college
-        if college:
-            tags = college.tags.all()
-        else:
-            tags = []
-        posts = self.get_queryset().filter(tags__in=tags).distinct()
-        return Response(self.get_context_serializer_class(PostSerializer, posts, many=True).data)
+        college_id = request.user.profile.college_id
+        if not college_id:
+            return self.get_paginated_posts_response(Post.objects.none())
+        tag_ids = Tag.objects.filter(college=college_id).values_list('id', flat=True)
+        version_keys = [tag_version_key(tag_id) for tag_id in tag_ids]
+        if request.query_params.get('order') == 'hot':
+            version_keys.append(hot_version_key())
+        versions = get_versions(version_keys)
+        entries = FeedEntry.objects.filter(visible_to_q(request.user, 'post__'), college=college_id)
+        entries = entries.select_related('post')
+        page, next_link, previous_link = self.get_cached_page(
+            'post:feed:%d:%d' % (college_id, request.user.id), versions, entries, lambda entry: entry.post)
+        posts = [Post(pk=pk, user_id=user_id) for pk, user_id in page]
+        return self.get_data_response(posts, get_posts_versions, get_posts_data, (next_link, previous_link))
 
     @list_route()
     def current(self, request):
@@ -223,7 +318,114 @@ class PostViewset(SerializerClassRequestContextMixin, viewsets.ModelViewSet):
         Get posts of current user as OP
         """
         posts = self.get_queryset().filter(user=request.user)
-        return Response(self.get_context_serializer_class(PostSerializer, posts, many=True).data)
+        return self.get_paginated_posts_response(posts)
+
+    @list_route()
+    def search(self, request):
+        """
+        Search posts visible to user by words of title and content, best matches first
+        ---
+        serializer: post.serializers.PostSerializer
+        parameters:
+          - name: q
+            type: string
+            paramType: query
+          - name: page
+            type: integer
+            paramType: query
+        """
+        try:
+            page = int(request.query_params.get('page', 1))
+            if page < 1:
+                raise ValueError
+        except ValueError:
+            return Response({'page': ['Invalid page']}, status=HTTP_400_BAD_REQUEST)
+
+        page_size = self.search_page_size
+        posts = search_posts(request.user, request.query_params.get('q', ''), (page - 1) * page_size, page_size + 1)
+        url = request.build_absolute_uri()
+        next_link = replace_query_param(url, 'page', page + 1) if len(posts) > page_size else None
+        if page == 1:
+            previous_link = None
+        elif page == 2:
+            previous_link = remove_query_param(url, 'page')
+        else:
+            previous_link = replace_query_param(url, 'page', page - 1)
+        links = (next_link, previous_link)
+        return self.get_data_response(posts[:page_size], get_posts_versions, get_posts_data, links)
+
+    @list_route()
+    def changes(self, request):
+        """
+        Get posts and replies created, updated or deleted after `since` cursor, oldest change first. Pass `next` of
+        the response as `since` of the following request, `has_more` tells if changes are left. Posts and replies no
+        longer visible to user are listed in `deleted`. Without `since` all rows are returned.
+        ---
+        parameters:
+          - name: since
+            type: string
+            paramType: query
+        """
+        try:
+            cursor = decode_cursor(request.query_params.get('since'))
+        except ValueError as e:
+            return Response({'since': [str(e)]}, status=HTTP_400_BAD_REQUEST)
+
+        changes, has_more = get_changes(request.user, cursor, self.changes_page_size)
+        posts = [row for (_, change_type, _), row, visible in changes if visible and change_type == 'post']
+        replies = [row for (_, change_type, _), row, visible in changes if visible and change_type == 'reply']
+        deleted = [OrderedDict([('type', key[1]), ('id', key[2])]) for key, row, visible in changes if not visible]
+        return Response(OrderedDict([
+            ('next', encode_cursor(changes[-1][0]) if changes else request.query_params.get('since')),
+            ('has_more', has_more),
+            ('posts', get_posts_data(posts, request)),
+            ('replies', get_replies_data(replies, request)),
+            ('deleted', deleted),
+        ]))
+
+    @list_route(methods=['POST'], serializer_class=VoteBatchSerializer)
+    def vote_batch(self, request):
+        """
+        Apply a list of votes on posts and replies at once, as queued by offline clients. Later votes on the same
+        target override earlier ones. Targets not visible to user are reported with success false.
+        ---
+        request_serializer: post.serializers.VoteBatchSerializer
+        response_serializer: post.serializers.VoteResultSerializer
+        parameters_strategy:
+            form: replace
+        """
+        serialized_data = VoteBatchSerializer(data=request.data)
+        if not serialized_data.is_valid():
+            return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
+
+        operations = serialized_data.validated_data['votes']
+        models = {'post': Post, 'reply': Reply}
+        counters = {}
+        version_keys = set()
+        with transaction.atomic():
+            for target_type, model in models.items():
+                values = {op['id']: op['vote'] for op in operations if op['type'] == target_type}
+                if not values:
+                    continue
+                found = model.objects.visible_to(request.user).filter(pk__in=list(values))
+                post_ids = dict(found.values_list('id', 'id' if model is Post else 'post_id'))
+                changed = model.set_votes(request.user, {pk: values[pk] for pk in post_ids})
+                for pk in changed:
+                    version_keys.add(replies_version_key(post_ids[pk]))
+                    if model is Post:
+                        version_keys.add(post_version_key(pk))
+                rows = model.objects.filter(pk__in=list(post_ids)).values_list('id', 'upvote_count', 'downvote_count')
+                counters[target_type] = {pk: (upvotes, downvotes, values[pk]) for pk, upvotes, downvotes in rows}
+        bump_versions(version_keys)
+
+        results = []
+        for op in operations:
+            row = counters.get(op['type'], {}).get(op['id'])
+            result = OrderedDict([('type', op['type']), ('id', op['id']), ('success', row is not None)])
+            if row is not None:
+                result.update([('user_vote', row[2]), ('upvotes', row[0]), ('downvotes', row[1])])
+            results.append(result)
+        return Response(results)
 
 
 class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
@@ -231,9 +433,7 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        replies = Reply.objects.all().filter(visibility=CONTENT_VISIBLE)
-        replies |= Reply.objects.all().filter(visibility=CONTENT_HIDDEN, user=self.request.user)
-        return replies
+        return Reply.objects.visible_to(self.request.user)
 
     @list_route(methods=['POST'], serializer_class=NewReplySerializer)
     def add(self, request):
@@ -257,7 +457,9 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
                 pass
 
             reply.save()
-            return Response(self.get_context_serializer_class(ReplySerializer, reply).data)
+            Post.reply_changed(reply, was_visible=False)
+            bump_replies_version(reply.post_id, summary=True)
+            return Response(get_replies_data([reply], request)[0])
         else:
             return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
 
@@ -273,8 +475,11 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
         reply = self.get_object()
         if reply.user.id != request.user.id:
             return Response({'success': False, 'message': 'Unauthorized access'}, status=HTTP_403_FORBIDDEN)
+        was_visible = reply.visibility == CONTENT_VISIBLE
         reply.visibility = CONTENT_DELETED
-        reply.save()
+        reply.save(update_fields=['visibility', 'modified'])
+        Post.reply_changed(reply, was_visible)
+        bump_replies_version(reply.post_id, summary=True)
         return Response({'success': True, 'message': 'Reply deleted successfully'})
 
     @detail_route(methods=['POST'])
@@ -286,9 +491,9 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
             form: replace
         """
         reply = self.get_object()
-        reply.downvotes.remove(request.user)
-        reply.upvotes.add(request.user)
-        return Response(self.get_context_serializer_class(ReplySerializer, reply).data)
+        reply.set_vote(request.user, VOTE_UP)
+        bump_replies_version(reply.post_id)
+        return Response(get_replies_data([reply], request)[0])
 
     @detail_route(methods=['POST'])
     def downvote(self, request, pk):
@@ -299,9 +504,9 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
             form: replace
         """
         reply = self.get_object()
-        reply.upvotes.remove(request.user)
-        reply.downvotes.add(request.user)
-        return Response(self.get_context_serializer_class(ReplySerializer, reply).data)
+        reply.set_vote(request.user, VOTE_DOWN)
+        bump_replies_version(reply.post_id)
+        return Response(get_replies_data([reply], request)[0])
 
     @detail_route(methods=['POST'])
     def remove_vote(self, request, pk):
@@ -312,6 +517,6 @@ class ReplyViewset(SerializerClassRequestContextMixin, viewsets.GenericViewSet):
             form: replace
         """
         reply = self.get_object()
-        reply.upvotes.remove(request.user)
-        reply.downvotes.remove(request.user)
-        return Response(self.get_context_serializer_class(ReplySerializer, reply).data)
+        reply.set_vote(request.user, VOTE_NONE)
+        bump_replies_version(reply.post_id)
+        return Response(get_replies_data([reply], request)[0])